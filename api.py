@@ -0,0 +1,170 @@
+"""SmartTrip AI HTTP API
+
+Exposes the planning engine over ASGI so it can be scaled independently of
+the Streamlit UI, e.g.:
+
+    uvicorn api:app --workers 4
+
+The Groq key is read from GROQ_API_KEY unless a request sends its own in the
+X-Groq-Api-Key header.
+"""
+from typing import List, Optional
+
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+
+from export import EXPORT_FORMATS, available_formats, export_file_name, export_plan
+from engine import (
+    get_api_key,
+    get_plan_cache,
+    get_weather_cache,
+    get_single_flight,
+    provider_stats,
+    render_metrics,
+    PROMETHEUS_CONTENT_TYPE,
+    get_plan_similarity_index,
+    get_weather_data,
+    get_location_images,
+    get_thumbnail,
+    reverse_geocode,
+    forward_geocode,
+    suggest_destinations,
+    get_gazetteer,
+    generate_travel_plan,
+    stream_travel_plan,
+    answer_question
+)
+
+app = FastAPI(title="SmartTrip AI", version="1.0")
+
+class PlanRequest(BaseModel):
+    destination: str
+    duration: int = Field(5, ge=1, le=30)
+    budget: str = "Moderate"
+    travel_style: List[str] = ["Culture", "Nature"]
+    from_location: Optional[str] = None
+    force_regenerate: bool = False
+    latitude: Optional[float] = Field(None, ge=-90, le=90)
+    longitude: Optional[float] = Field(None, ge=-180, le=180)
+    stream: bool = False
+
+class QuestionTurn(BaseModel):
+    question: str
+    answer: str
+
+class QuestionRequest(BaseModel):
+    question: str
+    destination: str
+    travel_plan: Optional[str] = None
+    history: List[QuestionTurn] = []
+    stream: bool = False
+
+class ExportRequest(BaseModel):
+    travel_plan: str
+    destination: str = ""
+    format: str = "pdf"
+
+def _groq_key(header_key):
+    """Prefer a per-request key, falling back to the server's configured key"""
+    groq_api_key = header_key or get_api_key("GROQ_API_KEY")
+    if not groq_api_key:
+        raise HTTPException(status_code=400, detail="Please provide your Groq API key")
+    return groq_api_key
+
+# Endpoints are plain (sync) functions so FastAPI runs the blocking engine
+# calls in its thread pool instead of on the event loop.
+@app.post("/plan")
+def plan(request: PlanRequest, x_groq_api_key: Optional[str] = Header(None)):
+    """Generate (or fetch from cache) a travel plan"""
+    groq_api_key = _groq_key(x_groq_api_key)
+    args = (request.destination, request.duration, request.budget, request.travel_style,
+            groq_api_key, request.from_location, request.force_regenerate)
+    # Known coordinates let the plan share the forecast cached for the weather endpoint
+    coords = (request.latitude, request.longitude) if request.latitude is not None and request.longitude is not None else None
+    if request.stream:
+        return StreamingResponse(stream_travel_plan(*args, coords=coords), media_type="text/markdown")
+    try:
+        plan_content = generate_travel_plan(*args, coords=coords)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Error generating travel plan: {str(e)}")
+    return {"destination": request.destination, "plan": plan_content}
+
+@app.post("/qa")
+def qa(request: QuestionRequest, x_groq_api_key: Optional[str] = Header(None)):
+    """Answer a follow-up question about a destination or plan"""
+    groq_api_key = _groq_key(x_groq_api_key)
+    try:
+        answer = answer_question(request.question, request.destination, groq_api_key,
+                                 request.travel_plan, stream=request.stream,
+                                 history=[turn.model_dump() for turn in request.history])
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Error getting answer: {str(e)}")
+    if request.stream:
+        return StreamingResponse(answer, media_type="text/markdown")
+    return {"question": request.question, "answer": answer}
+
+@app.post("/export")
+def export(request: ExportRequest):
+    """Render a plan as a PDF, HTML or plain-text download"""
+    if request.format not in available_formats():
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {request.format}")
+    file_name = export_file_name(request.destination, request.format)
+    return Response(
+        export_plan(request.travel_plan, request.destination, request.format),
+        media_type=EXPORT_FORMATS[request.format][0],
+        headers={"Content-Disposition": f'attachment; filename="{file_name}"'}
+    )
+
+@app.get("/weather")
+def weather(lat: float = Query(..., ge=-90, le=90), lon: float = Query(..., ge=-180, le=180)):
+    """Current conditions and a per-day 5-day forecast for a coordinate"""
+    weather_data = get_weather_data(lat, lon, None)
+    if weather_data is None:
+        raise HTTPException(status_code=503, detail="Weather data unavailable")
+    return weather_data
+
+@app.get("/images")
+def images(location: str):
+    """Destination image URLs"""
+    return {"location": location, "images": get_location_images(location)}
+
+@app.get("/thumbnail")
+def thumbnail(url: str):
+    """Gallery-sized, disk-cached JPEG of a destination image"""
+    path = get_thumbnail(url)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Thumbnail unavailable")
+    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": "public, max-age=604800"})
+
+@app.get("/geocode/reverse")
+def geocode_reverse(lat: float = Query(..., ge=-90, le=90), lon: float = Query(..., ge=-180, le=180)):
+    """Place name for a coordinate"""
+    return {"latitude": lat, "longitude": lon, "location": reverse_geocode(lat, lon)}
+
+@app.get("/geocode/search")
+def geocode_search(q: str, limit: int = Query(8, ge=1, le=50)):
+    """Best match and autocomplete suggestions for a place name"""
+    gazetteer = get_gazetteer()
+    suggestions = [
+        {"location": gazetteer.label(idx), "latitude": float(gazetteer.lats[idx]), "longitude": float(gazetteer.lons[idx])}
+        for idx in suggest_destinations(q, limit)
+    ]
+    return {"query": q, "match": forward_geocode(q), "suggestions": suggestions}
+
+@app.get("/health")
+def health():
+    """Liveness check with cache statistics"""
+    return {
+        "status": "ok",
+        "plan_cache": get_plan_cache().stats(),
+        "weather_cache": get_weather_cache().stats(),
+        "single_flight": get_single_flight().stats(),
+        "plan_reuse": get_plan_similarity_index().stats(),
+        "providers": provider_stats()
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Latency histograms, error counts, token counts and cache hit ratios for Prometheus"""
+    return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,568 @@
+"""Offline end-to-end benchmark for the SmartTrip AI Streamlit app
+
+Starts a local stub server per provider (Groq, SerpAPI, OpenWeather,
+Unsplash, Nominatim, ipinfo, ip-api), points the engine at them through the
+*_BASE_URL environment variables and drives main.py headlessly with
+Streamlit's AppTest from N concurrent simulated sessions, one process each:
+
+    python benchmark.py --sessions 8
+    python benchmark.py --scenario plan --latency groq=0.5 --error-rate serpapi=0.2 --tokens-per-second 100
+
+Scenarios: browse (settings and gallery), map (a map click, reverse geocoded
+through the Nominatim stub unless a local gazetteer answers), plan (a
+markdown plan), structured (a long trip in structured mode: skeleton, sections
+and parallel day chunks, answered by the Groq stub in JSON mode) and qa.
+
+For each scenario it reports p50/p95/p99 script run latency, time to the
+first plan token, plan completion time, throughput and the calls each
+provider received. Each session process renders the app once before the
+clock starts, so the figures are for a warm process rather than the import
+cold start.
+
+Sessions share the on-disk caches (plans, saved plans, thumbnails, speech),
+which live in a fresh temporary directory per invocation; later scenarios run
+against the caches warmed by earlier ones. In-memory caches, single-flight
+coalescing and the plan job queue are per process, so unlike sessions of one
+Streamlit server, sessions do not share them.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+BASE_URL_ENV = {
+    'groq': "GROQ_BASE_URL",
+    'serpapi': "SERPAPI_BASE_URL",
+    'openweather': "OPENWEATHER_BASE_URL",
+    'unsplash': "UNSPLASH_BASE_URL",
+    'nominatim': "NOMINATIM_BASE_URL",
+    'ipinfo': "IPINFO_BASE_URL",
+    'ip-api': "IP_API_BASE_URL"
+}
+DEFAULT_LATENCY = {
+    'groq': 0.3,
+    'serpapi': 0.4,
+    'openweather': 0.15,
+    'unsplash': 0.2,
+    'nominatim': 0.3,
+    'ipinfo': 0.1,
+    'ip-api': 0.1
+}
+DESTINATIONS = [
+    ("Paris, France", 48.8566, 2.3522),
+    ("Tokyo, Japan", 35.6762, 139.6503),
+    ("Rome, Italy", 41.9028, 12.4964),
+    ("New York, United States", 40.7128, -74.0060),
+    ("Cape Town, South Africa", -33.9249, 18.4241),
+    ("Sydney, Australia", -33.8688, 151.2093)
+]
+SCENARIOS = ['browse', 'map', 'plan', 'structured', 'qa']
+STRUCTURED_DURATION = 12  # Long enough for the skeleton plus parallel day chunks
+
+# Provider stubs
+
+class StubProvider:
+    """Local HTTP stand-in for one provider with injected latency and errors"""
+
+    def __init__(self, name, respond, latency=0.0, error_rate=0.0):
+        self.name = name
+        self.respond = respond
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub._handle(self, None)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                stub._handle(self, json.loads(self.rfile.read(length) or b"{}"))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, name=f"stub-{name}", daemon=True).start()
+
+    def _handle(self, handler, body):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            with self._lock:
+                self.errors += 1
+            send_json(handler, {'error': "injected failure"}, status=503)
+            return
+        url = urlparse(handler.path)
+        self.respond(handler, url.path, {key: values[0] for key, values in parse_qs(url.query).items()}, body)
+
+    def counters(self):
+        with self._lock:
+            return {'calls': self.calls, 'errors': self.errors}
+
+    def close(self):
+        self.server.shutdown()
+
+def send_json(handler, payload, status=200):
+    data = json.dumps(payload).encode()
+    handler.send_response(status)
+    handler.send_header("Content-Type", "application/json")
+    handler.send_header("Content-Length", str(len(data)))
+    handler.end_headers()
+    handler.wfile.write(data)
+
+def synthetic_plan(tokens):
+    """Markdown plan-shaped text of roughly the given number of tokens"""
+    words = []
+    sections = ["Best Time to Visit", "Accommodation", "Day-by-Day Itinerary", "Food & Dining",
+                "Transportation", "Budget Breakdown", "Essential Tips"]
+    while len(words) < tokens:
+        for section in sections:
+            words.extend(["\n\n##", f"{section}\n"])
+            words.extend(f"- Recommendation {len(words)} with local details and practical advice\n".split(" "))
+    return [word + " " for word in words[:tokens]]
+
+def structured_completion(prompt):
+    """Minimal valid JSON for a structured plan prompt: a skeleton, sections or days"""
+    days = re.search(r"Write the itinerary for days ([\d, ]+) only", prompt)
+    if days:
+        return {'days': [
+            {'day': int(n), 'title': f"Day {n} highlights", 'activities': [
+                {'time': slot, 'title': f"Sight {n}.{i}", 'description': "Local details and practical advice",
+                 'estimated_cost': "$20"}
+                for i, slot in enumerate(("09:00", "13:00", "17:00"), 1)
+            ]}
+            for n in days.group(1).split(",")
+        ]}
+    skeleton = re.search(r"covering days ([\d, ]+)\.", prompt)
+    if skeleton:
+        return {'base': "Stay central, travel by metro, plan a moderate daily budget.",
+                'day_themes': {n.strip(): f"Neighbourhood {n.strip()} and its key sights" for n in skeleton.group(1).split(",")}}
+    return {'sections': {key: "- Recommendation with local details and practical advice"
+                         for key in re.findall(r'^- "(\w+)":', prompt, re.MULTILINE)}}
+
+def groq_responder(plan_tokens, tokens_per_second):
+    """OpenAI-compatible chat completions, streamed at tokens_per_second when asked"""
+    def respond(handler, path, query, body):
+        body = body or {}
+        if (body.get('response_format') or {}).get('type') == 'json_object':
+            prompt = (body.get('messages') or [{}])[-1].get('content', "")
+            tokens = [word + " " for word in json.dumps(structured_completion(prompt)).split(" ")]
+        else:
+            tokens = synthetic_plan(min(plan_tokens, body.get('max_tokens') or plan_tokens))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get('model', "stub")
+        usage = {'prompt_tokens': len(json.dumps(body.get('messages', []))) // 4,
+                 'completion_tokens': len(tokens)}
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+
+        if not body.get('stream'):
+            if tokens_per_second:
+                time.sleep(len(tokens) / tokens_per_second)
+            send_json(handler, {
+                'id': completion_id, 'object': "chat.completion", 'created': created, 'model': model,
+                'choices': [{'index': 0, 'message': {'role': "assistant", 'content': "".join(tokens)}, 'finish_reason': "stop"}],
+                'usage': usage
+            })
+            return
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+
+        def event(delta, finish_reason=None, extra=None):
+            chunk = {'id': completion_id, 'object': "chat.completion.chunk", 'created': created, 'model': model,
+                     'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+            chunk.update(extra or {})
+            handler.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            handler.wfile.flush()
+
+        event({'role': "assistant", 'content': ""})
+        for token in tokens:
+            if tokens_per_second:
+                time.sleep(1 / tokens_per_second)
+            event({'content': token})
+        event({}, "stop", {'x_groq': {'usage': usage}})
+        handler.wfile.write(b"data: [DONE]\n\n")
+    return respond
+
+def serpapi_responder(handler, path, query, body):
+    send_json(handler, {'organic_results': [
+        {'title': f"{query.get('q', '')} result {i}", 'snippet': "Top attractions, neighbourhoods and tips."}
+        for i in range(5)
+    ]})
+
+def openweather_responder(handler, path, query, body):
+    start = int(time.time()) // 10800 * 10800
+    slots = []
+    for i in range(int(query.get('cnt', 40))):
+        dt = start + i * 10800
+        temp = 18 + 6 * np.sin(i / 8 * 2 * np.pi)
+        slots.append({
+            'dt': dt,
+            'dt_txt': time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(dt)),
+            'main': {'temp': temp, 'temp_min': temp - 1, 'temp_max': temp + 1, 'humidity': 60},
+            'weather': [{'id': 800 if i % 3 else 500, 'main': "Clear" if i % 3 else "Rain",
+                         'description': "clear sky" if i % 3 else "light rain", 'icon': "01d"}],
+            'pop': 0.0 if i % 3 else 0.6,
+            'wind': {'speed': 3.0}
+        })
+    send_json(handler, {'cod': "200", 'cnt': len(slots), 'list': slots,
+                        'city': {'name': "Stub City", 'timezone': 0}})
+
+def unsplash_responder(handler, path, query, body):
+    send_json(handler, {'results': [
+        {'urls': {'regular': f"https://images.example.invalid/{uuid.uuid4().hex}.jpg"}}
+        for _ in range(int(query.get('per_page', 6)))
+    ]})
+
+def nominatim_responder(handler, path, query, body):
+    send_json(handler, {
+        'place_id': 1, 'lat': query.get('lat', "0"), 'lon': query.get('lon', "0"),
+        'display_name': "Stub Place, Stub Region, Stub Country",
+        'address': {'city': "Stub Place", 'state': "Stub Region", 'country': "Stub Country"}
+    })
+
+def ipinfo_responder(handler, path, query, body):
+    send_json(handler, {'ip': "203.0.113.1", 'city': "Paris", 'region': "Île-de-France", 'country': "FR", 'loc': "48.8566,2.3522"})
+
+def ip_api_responder(handler, path, query, body):
+    send_json(handler, {'status': "success", 'city': "Paris", 'regionName': "Île-de-France", 'country': "France",
+                        'lat': 48.8566, 'lon': 2.3522})
+
+def start_stubs(latency, error_rate, plan_tokens, tokens_per_second):
+    responders = {
+        'groq': groq_responder(plan_tokens, tokens_per_second),
+        'serpapi': serpapi_responder,
+        'openweather': openweather_responder,
+        'unsplash': unsplash_responder,
+        'nominatim': nominatim_responder,
+        'ipinfo': ipinfo_responder,
+        'ip-api': ip_api_responder
+    }
+    return {
+        name: StubProvider(name, respond, latency.get(name, 0.0), error_rate.get(name, 0.0))
+        for name, respond in responders.items()
+    }
+
+def configure_environment(stubs, workdir, keep_rate_limits):
+    """Point the engine at the stubs and at scratch caches; must run before it is imported"""
+    for name, stub in stubs.items():
+        os.environ[BASE_URL_ENV[name]] = stub.url
+    for key in ("GROQ_API_KEY", "SERP_API_KEY", "OPENWEATHER_API_KEY", "UNSPLASH_ACCESS_KEY"):
+        os.environ[key] = "benchmark"
+    os.environ["PLAN_CACHE_PATH"] = os.path.join(workdir, "plan_cache.sqlite3")
+    os.environ["SAVED_PLANS_PATH"] = os.path.join(workdir, "saved_plans.sqlite3")
+    os.environ["THUMBNAIL_DIR"] = os.path.join(workdir, "thumbnails")
+    os.environ["TTS_CACHE_DIR"] = os.path.join(workdir, "tts")
+    if not keep_rate_limits:
+        # Measure the app, not the per-provider quotas
+        for name in stubs:
+            os.environ[f"RATE_LIMIT_{name.upper().replace('-', '_')}"] = "1000,1000"
+
+# Simulated sessions
+
+class Recorder:
+    """Thread-safe collection of a session's or a scenario's measurements"""
+
+    def __init__(self):
+        self.run_seconds = []
+        self.first_token_seconds = []
+        self.plan_seconds = []
+        self.plans = 0
+        self.failures = []
+        self._lock = threading.Lock()
+
+    def timed(self, action):
+        """Run one script run (a callable returning the AppTest) and record its latency"""
+        start = time.perf_counter()
+        at = action()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.run_seconds.append(elapsed)
+            self.failures.extend(str(exception.value) for exception in at.exception)
+        return at
+
+    def as_dict(self):
+        return {'run_seconds': self.run_seconds, 'first_token_seconds': self.first_token_seconds,
+                'plan_seconds': self.plan_seconds, 'plans': self.plans, 'failures': self.failures}
+
+    def merge(self, data):
+        """Add the measurements of another session"""
+        with self._lock:
+            self.run_seconds.extend(data['run_seconds'])
+            self.first_token_seconds.extend(data['first_token_seconds'])
+            self.plan_seconds.extend(data['plan_seconds'])
+            self.plans += data['plans']
+            self.failures.extend(data['failures'])
+
+    def plan_job(self, job):
+        with self._lock:
+            if job.status == 'done':
+                self.plans += 1
+                self.plan_seconds.append(job.finished_at - job.created_at)
+                if job.first_chunk_at:
+                    self.first_token_seconds.append(job.first_chunk_at - job.created_at)
+            else:
+                self.failures.append(f"plan job {job.status}: {job.error}")
+
+def _widget(widgets, label):
+    for widget in widgets:
+        if widget.label.startswith(label):
+            return widget
+    raise LookupError(f"no widget labelled {label!r} (script run failed or timed out?)")
+
+def _select_destination(at, destination):
+    name, lat, lon = destination
+    at.session_state.selected_location = name
+    at.session_state.selected_coords = [lat, lon]
+
+def browse_session(at, recorder, destination, timeout):
+    """Land, tweak trip settings, pick a destination and load its gallery"""
+    recorder.timed(at.run)
+    recorder.timed(lambda: _widget(at.sidebar.number_input, "📅 Duration").set_value(4).run())
+    recorder.timed(lambda: _widget(at.sidebar.multiselect, "🎯 Travel Style").select("Food").run())
+    _select_destination(at, destination)
+    recorder.timed(at.run)
+    recorder.timed(lambda: _widget(at.button, "🖼 Load Images").click().run())
+
+def map_session(at, recorder, destination, timeout):
+    """Land and click the map near a destination, which reverse geocodes the point"""
+    _, lat, lon = destination
+    recorder.timed(at.run)
+    # AppTest cannot click the map, so set the value the map component would return
+    map_component = next((element for element in at.get("component_instance")
+                          if "folium" in element.proto.component_name), None)
+    if map_component is None:
+        recorder.failures.append("no map component was rendered")
+        return
+    # Points differ per session so every click is a fresh lookup
+    at.session_state[map_component.key] = {'last_clicked': {'lat': lat + random.uniform(-0.05, 0.05),
+                                                            'lng': lon + random.uniform(-0.05, 0.05)}}
+    recorder.timed(at.run)
+    if not at.session_state.selected_location:
+        recorder.failures.append("the map click selected no destination")
+
+def plan_session(at, recorder, destination, timeout):
+    """Land, pick a destination, generate a plan and wait for it to be delivered"""
+    recorder.timed(at.run)
+    _select_destination(at, destination)
+    recorder.timed(at.run)
+    _generate_plan(at, recorder, timeout)
+
+def structured_session(at, recorder, destination, timeout):
+    """Like plan_session for a long trip, which defaults to structured mode and parallel day chunks"""
+    recorder.timed(at.run)
+    _select_destination(at, destination)
+    recorder.timed(lambda: _widget(at.sidebar.number_input, "📅 Duration").set_value(STRUCTURED_DURATION).run())
+    if not _widget(at.checkbox, "🧩 Structured plan").value:
+        recorder.failures.append("structured mode is not enabled")
+        return
+    job = _generate_plan(at, recorder, timeout)
+    if job is not None and job.status == 'done' and len(job.value.days) != STRUCTURED_DURATION:
+        recorder.failures.append(f"structured plan has {len(job.value.days)} of {STRUCTURED_DURATION} days")
+
+def _generate_plan(at, recorder, timeout):
+    """Click Generate, wait for the background plan job and deliver it; returns the job"""
+    from engine import get_plan_job_queue
+
+    recorder.timed(lambda: _widget(at.button, "✨ Generate").click().run())
+    job = get_plan_job_queue().get(at.session_state.plan_job_id) if at.session_state.plan_job_id else None
+    if job is None:
+        recorder.failures.append("no plan job was submitted")
+        return None
+    deadline = time.time() + timeout
+    while not job.finished and time.time() < deadline:
+        time.sleep(0.02)
+    recorder.plan_job(job)
+    # The progress fragment picks up the finished job and delivers the plan
+    recorder.timed(at.run)
+    return job
+
+def qa_session(at, recorder, destination, timeout):
+    """Land, pick a destination and ask a streamed follow-up question"""
+    recorder.timed(at.run)
+    _select_destination(at, destination)
+    recorder.timed(at.run)
+    _widget(at.text_input, "Your question:").input(f"What should I eat in {destination[0]}?")
+    recorder.timed(lambda: _widget(at.button, "Get Answer").click().run())
+
+SESSION_SCRIPTS = {'browse': browse_session, 'map': map_session, 'plan': plan_session,
+                   'structured': structured_session, 'qa': qa_session}
+
+def session_process(name, index, destination, timeout, ready, start, results):
+    """One simulated session in its own interpreter
+
+    AppTest drives a single session per process, so sessions run in separate
+    processes. Each renders the app once untimed (imports, first script
+    compile), reports ready, waits for the common start and sends back its
+    measurements.
+    """
+    sys.path.insert(0, os.path.dirname(APP_PATH))
+    from streamlit.testing.v1 import AppTest
+
+    recorder = Recorder()
+    try:
+        AppTest.from_file(APP_PATH, default_timeout=timeout).run()
+    except Exception as e:
+        recorder.failures.append(f"warm-up: {type(e).__name__}: {e}")
+    ready.put(index)
+    start.wait()
+    try:
+        at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        SESSION_SCRIPTS[name](at, recorder, destination, timeout)
+    except Exception as e:
+        recorder.failures.append(f"{type(e).__name__}: {e}")
+    results.put(recorder.as_dict())
+
+def run_scenario(name, sessions, destinations, stubs, timeout):
+    """Run one scenario with concurrent session processes and summarise it"""
+    context = multiprocessing.get_context("spawn")
+    ready, results, start = context.Queue(), context.Queue(), context.Event()
+    processes = [
+        context.Process(target=session_process, name=f"session-{index}", daemon=True,
+                        args=(name, index, DESTINATIONS[index % destinations], timeout, ready, start, results))
+        for index in range(sessions)
+    ]
+    for process in processes:
+        process.start()
+
+    recorder = Recorder()
+    # Every session is warmed up before the clock and the provider counters start
+    deadline = time.time() + 2 * timeout
+    for _ in processes:
+        try:
+            ready.get(timeout=max(0.0, deadline - time.time()))
+        except queue.Empty:
+            recorder.failures.append("a session did not start in time")
+            break
+    calls_before = {provider: stub.counters() for provider, stub in stubs.items()}
+    started = time.perf_counter()
+    start.set()
+
+    # A session that hangs is reported and killed rather than stalling the run
+    deadline = time.time() + 4 * timeout
+    for _ in processes:
+        try:
+            recorder.merge(results.get(timeout=max(0.0, deadline - time.time())))
+        except queue.Empty:
+            recorder.failures.append(f"a session did not finish within {4 * timeout:.0f}s")
+            break
+    wall_seconds = time.perf_counter() - started
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.kill()
+
+    calls = {}
+    for provider, stub in stubs.items():
+        after = stub.counters()
+        calls[provider] = {key: after[key] - calls_before[provider][key] for key in after}
+    return summarize(name, sessions, wall_seconds, recorder, calls)
+
+def _percentiles(values):
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(np.asarray(values) * 1000, [50, 95, 99])
+    return {'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99)}
+
+def summarize(name, sessions, wall_seconds, recorder, calls):
+    return {
+        'scenario': name,
+        'sessions': sessions,
+        'wall_seconds': wall_seconds,
+        'runs': len(recorder.run_seconds),
+        'run_latency': _percentiles(recorder.run_seconds),
+        'first_token': _percentiles(recorder.first_token_seconds),
+        'plan_completion': _percentiles(recorder.plan_seconds),
+        'runs_per_second': len(recorder.run_seconds) / wall_seconds if wall_seconds else 0.0,
+        'plans_per_second': recorder.plans / wall_seconds if wall_seconds else 0.0,
+        'calls': calls,
+        'failures': recorder.failures
+    }
+
+def format_report(results):
+    lines = []
+    for result in results:
+        lines.append(f"== {result['scenario']} ({result['sessions']} sessions, {result['wall_seconds']:.2f}s)")
+        for label, key in (("script runs", 'run_latency'), ("first token", 'first_token'), ("plan done", 'plan_completion')):
+            stats = result[key]
+            if stats:
+                lines.append(f"  {label:<12} p50 {stats['p50_ms']:8.1f} ms   p95 {stats['p95_ms']:8.1f} ms   p99 {stats['p99_ms']:8.1f} ms")
+        lines.append(f"  throughput   {result['runs_per_second']:.1f} runs/s, {result['plans_per_second']:.2f} plans/s ({result['runs']} runs)")
+        calls = ", ".join(f"{provider}={counts['calls']}" + (f" ({counts['errors']} failed)" if counts['errors'] else "")
+                          for provider, counts in result['calls'].items() if counts['calls'])
+        lines.append(f"  calls        {calls or 'none'}")
+        if result['failures']:
+            lines.append(f"  failures     {len(result['failures'])}: {result['failures'][0]}")
+    return "\n".join(lines)
+
+def _provider_values(pairs, defaults=None):
+    """Parse repeated provider=value options"""
+    values = dict(defaults or {})
+    for pair in pairs or []:
+        provider, _, value = pair.partition("=")
+        if provider not in BASE_URL_ENV:
+            raise SystemExit(f"Unknown provider: {provider}")
+        values[provider] = float(value)
+    return values
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scenario", choices=SCENARIOS + ['all'], default='all')
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent simulated sessions")
+    parser.add_argument("--destinations", type=int, default=2,
+                        help=f"distinct destinations shared by the sessions (1-{len(DESTINATIONS)})")
+    parser.add_argument("--latency", action="append", metavar="PROVIDER=SECONDS", help="stub response latency")
+    parser.add_argument("--error-rate", action="append", metavar="PROVIDER=P", help="fraction of stub calls failing with 503")
+    parser.add_argument("--tokens-per-second", type=float, default=250.0, help="Groq stub token speed (0: instant)")
+    parser.add_argument("--plan-tokens", type=int, default=400, help="tokens per stub completion")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds allowed per script run or plan")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="keep the engine's provider rate limits")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    stubs = start_stubs(_provider_values(args.latency, DEFAULT_LATENCY), _provider_values(args.error_rate),
+                        args.plan_tokens, args.tokens_per_second)
+    workdir = tempfile.mkdtemp(prefix="smarttrip-bench-")
+    configure_environment(stubs, workdir, args.keep_rate_limits)
+    sys.path.insert(0, os.path.dirname(APP_PATH))
+
+    destinations = max(1, min(args.destinations, len(DESTINATIONS)))
+    scenarios = SCENARIOS if args.scenario == 'all' else [args.scenario]
+    try:
+        results = [run_scenario(name, args.sessions, destinations, stubs, args.timeout) for name in scenarios]
+    finally:
+        for stub in stubs.values():
+            stub.close()
+
+    print(format_report(results))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 1 if any(result['failures'] for result in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
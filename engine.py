@@ -0,0 +1,2835 @@
+"""SmartTrip AI planning engine: provider lookups, caches and LLM calls
+
+Nothing in this module imports Streamlit, so it can back the Streamlit UI
+(main.py), the HTTP API (api.py) or any other service. Process-wide
+resources (caches, HTTP session, thread pool, indexes) are created lazily
+on first use and shared by every caller in the process.
+"""
+import os
+import sys
+import json
+import random
+import hashlib
+import re
+import zlib
+import logging
+import threading
+import tempfile
+import sqlite3
+import time
+import uuid
+import functools
+import importlib
+from collections import deque
+from contextlib import contextmanager
+import unicodedata
+import ipaddress
+from io import BytesIO
+from urllib.parse import urlparse, urlencode, parse_qsl
+from bisect import bisect_left, bisect_right
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+@functools.lru_cache(maxsize=None)
+def optional_import(name):
+    """Import a module on first use, or return None if it is not installed
+    
+    Heavy and optional clients (groq, geopy, geoip2, Pillow, pyttsx3) are
+    loaded this way so a cold start only pays for what a request needs.
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+def get_api_key(name):
+    """Read a provider API key from the environment at call time"""
+    return os.getenv(name, "")
+
+# Plan generation settings
+PLAN_MODEL = "llama-3.3-70b-versatile"
+PLAN_PROMPT_VERSION = "2"  # Bump whenever the travel plan prompt changes
+
+# Plan cache configuration
+PLAN_CACHE_PATH = os.getenv("PLAN_CACHE_PATH", os.path.join(tempfile.gettempdir(), "smarttrip_plan_cache.sqlite3"))
+PLAN_CACHE_TTL_SECONDS = int(os.getenv("PLAN_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "5000"))
+
+class PlanCache:
+    """Disk-backed SQLite cache for generated travel plans with TTL and LRU eviction"""
+
+    def __init__(self, path, ttl_seconds, max_entries):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS plans (
+                key TEXT PRIMARY KEY,
+                plan_content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_plans_last_accessed ON plans (last_accessed)")
+        # Entries with a shorter lifetime (plans quoting a forecast) carry their own expiry
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(plans)")]
+        if 'expires_at' not in columns:
+            self._conn.execute("ALTER TABLE plans ADD COLUMN expires_at REAL")
+        # Request parameters of each plan, for the similarity index
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS plan_params (
+                key TEXT PRIMARY KEY,
+                params TEXT NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, key, count=True):
+        """Return a cached plan or None, refreshing its LRU position on a hit
+        
+        With count=False the lookup is left out of the hit and miss counters.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT plan_content, COALESCE(expires_at, created_at + ?) FROM plans WHERE key = ?",
+                (self.ttl_seconds, key)
+            ).fetchone()
+            if row and now <= row[1]:
+                self._conn.execute("UPDATE plans SET last_accessed = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+                if count:
+                    self.hits += 1
+                return row[0]
+            if row:
+                # Expired entry
+                self._conn.execute("DELETE FROM plans WHERE key = ?", (key,))
+                self._conn.commit()
+            if count:
+                self.misses += 1
+            return None
+
+    def set(self, key, plan_content, params=None, ttl_seconds=None):
+        """Store a plan (and optionally its request parameters) and evict expired and least recently used entries
+        
+        ttl_seconds shortens the lifetime of this entry below the cache TTL.
+        """
+        now = time.time()
+        expires_at = now + min(ttl_seconds, self.ttl_seconds) if ttl_seconds is not None else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO plans (key, plan_content, created_at, last_accessed, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, plan_content, now, now, expires_at)
+            )
+            if params is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO plan_params (key, params) VALUES (?, ?)", (key, json.dumps(params))
+                )
+            self._evict(now)
+            self._conn.commit()
+
+    def copy(self, source_key, key, params):
+        """Store an existing plan under another key, keeping its age and expiry"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("""
+                INSERT OR REPLACE INTO plans (key, plan_content, created_at, last_accessed, expires_at)
+                SELECT ?, plan_content, created_at, ?, expires_at FROM plans WHERE key = ?
+            """, (key, now, source_key))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO plan_params (key, params) VALUES (?, ?)", (key, json.dumps(params))
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        # Called with the lock held
+        self._conn.execute("DELETE FROM plans WHERE COALESCE(expires_at, created_at + ?) < ?", (self.ttl_seconds, now))
+        self._conn.execute("""
+            DELETE FROM plans WHERE key IN (
+                SELECT key FROM plans ORDER BY last_accessed DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+        self._conn.execute("DELETE FROM plan_params WHERE key NOT IN (SELECT key FROM plans)")
+
+    def params(self):
+        """Return (key, params) for every live plan stored with its request parameters"""
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT plan_params.key, plan_params.params FROM plan_params
+                JOIN plans ON plans.key = plan_params.key
+                WHERE COALESCE(plans.expires_at, plans.created_at + ?) >= ?
+            """, (self.ttl_seconds, time.time())).fetchall()
+        return [(key, json.loads(params)) for key, params in rows]
+
+    def stats(self):
+        """Return hit/miss counters and the number of stored plans"""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM plans").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': size
+        }
+
+class RunTimings:
+    """Durations of UI script runs, keeping the process's first (cold) run apart"""
+
+    def __init__(self, window=500):
+        self.cold_start = None
+        self.cold_start_stages = {}
+        self.runs = 0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, stages=None):
+        """Record one run; stages breaks the cold start down (e.g. imports)"""
+        with self._lock:
+            if self.cold_start is None:
+                self.cold_start = seconds
+                self.cold_start_stages = dict(stages or {})
+            else:
+                self._recent.append(seconds)
+            self.runs += 1
+
+    def stats(self):
+        """Cold start and rerun latency percentiles, in seconds"""
+        with self._lock:
+            recent = np.asarray(self._recent)
+            stats = {'runs': self.runs, 'cold_start': self.cold_start, 'cold_start_stages': dict(self.cold_start_stages)}
+        if len(recent):
+            stats.update(last=float(recent[-1]), p50=float(np.percentile(recent, 50)), p95=float(np.percentile(recent, 95)))
+        return stats
+
+# Tracing and metrics configuration
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Standalone /metrics server for the UI; 0 disables it
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PROFILE_SLOW_RUN_SECONDS = float(os.getenv("PROFILE_SLOW_RUN_SECONDS", "0"))  # 0 disables the profiler
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_SECONDS", "0.005"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "smarttrip_profiles"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+METRIC_HELP = {
+    'smarttrip_span_seconds': "Duration of traced helpers and UI script sections",
+    'smarttrip_run_seconds': "Duration of UI script runs",
+    'smarttrip_provider_request_seconds': "Duration of external provider calls",
+    'smarttrip_provider_errors_total': "Failed external provider calls by reason",
+    'smarttrip_provider_rejected_total': "Provider calls rejected locally by the circuit breaker or rate limiter",
+    'smarttrip_provider_circuit_open': "1 while a provider's circuit breaker is not closed",
+    'smarttrip_llm_tokens_total': "Prompt and completion tokens reported by Groq",
+    'smarttrip_cache_hits_total': "Cache hits",
+    'smarttrip_cache_misses_total': "Cache misses",
+    'smarttrip_cache_hit_ratio': "Cache hits over lookups since the process started",
+    'smarttrip_cache_entries': "Entries currently stored in a cache",
+    'smarttrip_single_flight_calls_total': "Calls that ran (leader) or joined an identical in-flight call (coalesced)"
+}
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+def _prometheus_lines(name, kind, samples):
+    """Exposition lines for one metric; samples are (suffix, labels, value) tuples"""
+    lines = [f"# HELP {name} {METRIC_HELP.get(name, name)}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{suffix}{_format_labels(labels)} {value:g}" for suffix, labels, value in samples)
+    return lines
+
+class Metrics:
+    """Thread-safe counters and latency histograms, rendered in Prometheus text format"""
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [per-bucket counts (last is +Inf), sum, count]
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][bisect_left(self.buckets, seconds)] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def render(self):
+        """Counters and histograms as Prometheus exposition lines"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(counts), total, count) for key, (counts, total, count) in self._histograms.items()}
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            samples = [("", labels, value) for (metric, labels), value in sorted(counters.items()) if metric == name]
+            lines.extend(_prometheus_lines(name, "counter", samples))
+        bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+        for name in sorted({name for name, _ in histograms}):
+            samples = []
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, cumulative in zip(bounds, np.cumsum(counts)):
+                    samples.append(("_bucket", labels + (('le', bound),), int(cumulative)))
+                samples.extend([("_sum", labels, total), ("_count", labels, count)])
+            lines.extend(_prometheus_lines(name, "histogram", samples))
+        return lines
+
+class StackSampler:
+    """Samples one thread's Python stack on a timer, as collapsed stacks for flame graphs"""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL_SECONDS):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                # The sampled thread has exited
+                return
+            stack = []
+            while frame is not None:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            self.samples[key] = self.samples.get(key, 0) + 1
+
+    def collapsed(self):
+        """Samples in the folded format read by flamegraph.pl and speedscope"""
+        return "\n".join(f"{stack} {count}" for stack, count in sorted(self.samples.items(), key=lambda item: -item[1]))
+
+class RunTrace:
+    """Timed spans recorded during one UI script run"""
+
+    def __init__(self, name, started=None, sampler=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started = time.perf_counter() if started is None else started
+        self.sampler = sampler
+        self.spans = []
+
+    def add(self, name, start, seconds, labels=None):
+        # list.append is atomic, so worker threads (see fetch_concurrently) can add spans too
+        self.spans.append({'name': name, 'offset': start - self.started, 'seconds': seconds, 'labels': dict(labels or {})})
+
+    def as_dict(self, seconds):
+        return {'id': self.id, 'name': self.name, 'seconds': seconds,
+                'spans': sorted(self.spans, key=lambda span: span['offset'])}
+
+_trace_state = threading.local()
+
+def current_trace():
+    """The run trace active on this thread, if any"""
+    return getattr(_trace_state, 'trace', None)
+
+def start_run_trace(name, started=None):
+    """Begin tracing a script run on this thread, sampling its stack when slow-run profiling is on"""
+    previous = current_trace()
+    if previous is not None and previous.sampler:
+        # The previous run was interrupted (e.g. by st.rerun) before it finished
+        previous.sampler.stop()
+    sampler = StackSampler(threading.get_ident()).start() if PROFILE_SLOW_RUN_SECONDS > 0 else None
+    _trace_state.trace = RunTrace(name, started, sampler)
+    return _trace_state.trace
+
+def finish_run_trace():
+    """End this thread's run trace, dumping a profile if the run was slow; returns its duration"""
+    trace = current_trace()
+    if trace is None:
+        return None
+    _trace_state.trace = None
+    seconds = time.perf_counter() - trace.started
+    get_metrics().observe('smarttrip_run_seconds', seconds, script=trace.name)
+    if trace.sampler:
+        trace.sampler.stop()
+        if seconds >= PROFILE_SLOW_RUN_SECONDS:
+            _dump_slow_run(trace, seconds)
+    return seconds
+
+def _dump_slow_run(trace, seconds):
+    """Write a slow run's spans (JSON) and stack samples (folded) to PROFILE_DIR"""
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{trace.name}-{trace.id}")
+        with open(f"{base}.json", "w") as f:
+            json.dump(trace.as_dict(seconds), f, indent=2)
+        with open(f"{base}.folded", "w") as f:
+            f.write(trace.sampler.collapsed())
+        logger.warning("Slow %s run (%.2fs), profile written to %s.folded", trace.name, seconds, base)
+        dumps = sorted(os.listdir(PROFILE_DIR))
+        for name in dumps[:max(0, len(dumps) - 2 * PROFILE_MAX_FILES)]:
+            os.remove(os.path.join(PROFILE_DIR, name))
+    except OSError as e:
+        logger.warning("Could not write slow run profile: %s", e)
+
+def _add_to_trace(name, start, seconds, labels=None):
+    trace = current_trace()
+    if trace is not None:
+        trace.add(name, start, seconds, labels)
+
+@contextmanager
+def span(name, **labels):
+    """Time a block into the span histogram and the current run's trace"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        get_metrics().observe('smarttrip_span_seconds', seconds, span=name)
+        _add_to_trace(name, start, seconds, labels)
+
+def traced(name=None):
+    """Decorator timing every call of a function as a span"""
+    def decorate(func):
+        span_name = name or func.__name__
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def record_provider_call(provider, start, error=None):
+    """Record one external call's latency, and its failure reason if it failed"""
+    seconds = time.perf_counter() - start
+    metrics = get_metrics()
+    metrics.observe('smarttrip_provider_request_seconds', seconds, provider=provider)
+    if error:
+        metrics.inc('smarttrip_provider_errors_total', provider=provider, reason=error)
+    _add_to_trace(f"provider:{provider}", start, seconds, {'error': error} if error else None)
+
+def record_llm_usage(usage, model=PLAN_MODEL):
+    """Count the prompt and completion tokens a Groq response reports"""
+    if usage is None:
+        return
+    metrics = get_metrics()
+    metrics.inc('smarttrip_llm_tokens_total', usage.prompt_tokens or 0, model=model, kind='prompt')
+    metrics.inc('smarttrip_llm_tokens_total', usage.completion_tokens or 0, model=model, kind='completion')
+
+def render_metrics():
+    """Every process metric in Prometheus text exposition format"""
+    lines = get_metrics().render()
+    
+    # Cache statistics, for the caches this process has created
+    caches = {'plan': get_plan_cache, 'weather': get_weather_cache, 'images': get_image_cache,
+              'ip_location': get_ip_location_cache}
+    cache_stats = {cache: getter().stats() for cache, getter in caches.items() if getter.cache_info().currsize}
+    for name, key in (('smarttrip_cache_hits_total', 'hits'), ('smarttrip_cache_misses_total', 'misses')):
+        lines.extend(_prometheus_lines(name, "counter", [
+            ("", (('cache', cache),), stats[key]) for cache, stats in cache_stats.items()
+        ]))
+    for name, key in (('smarttrip_cache_hit_ratio', 'hit_rate'), ('smarttrip_cache_entries', 'entries')):
+        lines.extend(_prometheus_lines(name, "gauge", [
+            ("", (('cache', cache),), stats[key]) for cache, stats in cache_stats.items()
+        ]))
+    single_flight = get_single_flight().stats()
+    lines.extend(_prometheus_lines('smarttrip_single_flight_calls_total', "counter", [
+        ("", (('outcome', 'leader'),), single_flight['leaders']),
+        ("", (('outcome', 'coalesced'),), single_flight['coalesced'])
+    ]))
+    
+    # Provider guards
+    guards = provider_stats()
+    lines.extend(_prometheus_lines('smarttrip_provider_rejected_total', "counter", [
+        ("", (('provider', provider), ('reason', reason)), stats[f'rejected_{reason}'])
+        for provider, stats in guards.items() for reason in ('open', 'rate_limited')
+    ]))
+    lines.extend(_prometheus_lines('smarttrip_provider_circuit_open', "gauge", [
+        ("", (('provider', provider),), int(stats['state'] != 'closed')) for provider, stats in guards.items()
+    ]))
+    return "\n".join(lines) + "\n"
+
+# Saved plan store configuration
+# Kept with the app data (not in the temp dir) so saved plans survive reboots and container restarts
+SAVED_PLANS_PATH = os.getenv("SAVED_PLANS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "saved_plans.sqlite3"))
+
+class SavedPlanStore:
+    """Persistent SQLite store of the plans users saved, with compressed bodies"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS saved_plans (
+                plan_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                duration_days INTEGER NOT NULL,
+                budget_level TEXT,
+                travel_style TEXT NOT NULL,
+                latitude REAL,
+                longitude REAL,
+                created_at REAL NOT NULL,
+                plan_body BLOB NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_saved_plans_user ON saved_plans (user_id, created_at DESC)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_saved_plans_destination ON saved_plans (destination)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_saved_plans_created_at ON saved_plans (created_at)")
+        self._conn.commit()
+
+    def save(self, user_id, destination, duration, budget, travel_style, plan_content, latitude=None, longitude=None):
+        """Store a plan and return its stable ID"""
+        plan_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO saved_plans (plan_id, user_id, destination, duration_days, budget_level, travel_style,
+                                            latitude, longitude, created_at, plan_body)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (plan_id, user_id, destination, int(duration), budget, json.dumps(list(travel_style or [])),
+                 latitude, longitude, time.time(), zlib.compress(plan_content.encode()))
+            )
+            self._conn.commit()
+        return plan_id
+
+    @staticmethod
+    def _summary(row):
+        plan_id, destination, duration, budget, travel_style, latitude, longitude, created_at = row[:8]
+        return {
+            'plan_id': plan_id,
+            'destination': destination,
+            'duration_days': duration,
+            'budget_level': budget,
+            'travel_style': json.loads(travel_style),
+            'latitude': latitude,
+            'longitude': longitude,
+            'created_at': created_at
+        }
+
+    def list(self, user_id, offset=0, limit=3):
+        """Return one page of a user's plans, newest first, without their bodies"""
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT plan_id, destination, duration_days, budget_level, travel_style, latitude, longitude, created_at
+                FROM saved_plans WHERE user_id = ? ORDER BY created_at DESC LIMIT ? OFFSET ?
+            """, (user_id, limit, offset)).fetchall()
+        return [self._summary(row) for row in rows]
+
+    def count(self, user_id):
+        """Number of plans a user has saved"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM saved_plans WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def locations(self, user_id, limit=5000):
+        """Return (latitude, longitude, destination) for a user's plans that have coordinates"""
+        with self._lock:
+            return self._conn.execute("""
+                SELECT latitude, longitude, destination FROM saved_plans
+                WHERE user_id = ? AND latitude IS NOT NULL AND longitude IS NOT NULL
+                ORDER BY created_at DESC LIMIT ?
+            """, (user_id, limit)).fetchall()
+
+    def get(self, plan_id, user_id):
+        """Return a user's plan including 'plan_content', or None"""
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT plan_id, destination, duration_days, budget_level, travel_style, latitude, longitude, created_at, plan_body
+                FROM saved_plans WHERE plan_id = ? AND user_id = ?
+            """, (plan_id, user_id)).fetchone()
+        if row is None:
+            return None
+        plan = self._summary(row)
+        plan['plan_content'] = zlib.decompress(row[8]).decode()
+        return plan
+
+# Weather cache configuration
+WEATHER_GRID_DEGREES = float(os.getenv("WEATHER_GRID_DEGREES", "0.1"))
+WEATHER_CACHE_TTL_SECONDS = int(os.getenv("WEATHER_CACHE_TTL_SECONDS", str(3 * 3600)))  # Forecasts update every 3 hours
+WEATHER_FORECAST_SLOTS = 40  # 5 days of 3-hour slots, the whole free forecast
+
+class TTLCache:
+    """Thread-safe in-memory cache with per-entry expiry and hit/miss counters"""
+
+    def __init__(self, ttl_seconds, max_entries=10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value or None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        """Store a value, dropping expired entries when the cache is full"""
+        now = time.time()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+                if len(self._entries) >= self.max_entries:
+                    # Still full: drop the entry closest to expiry
+                    del self._entries[min(self._entries, key=lambda k: self._entries[k][0])]
+            self._entries[key] = (now + self.ttl_seconds, value)
+
+    def stats(self):
+        """Return hit/miss counters and the number of stored entries"""
+        with self._lock:
+            size = len(self._entries)
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': size
+        }
+
+class SingleFlight:
+    """Coalesces concurrent identical calls so only one runs and every caller shares its outcome"""
+
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Run func() once per key at a time; concurrent callers wait for the same result"""
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = {'event': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        
+        if not is_leader:
+            call['event'].wait()
+            if call['error']:
+                raise call['error']
+            return call['result']
+        
+        try:
+            call['result'] = func()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['event'].set()
+
+    def stream(self, key, make_stream):
+        """Yield chunks from one shared make_stream() generator per key
+        
+        The generator runs on its own thread and every concurrent subscriber
+        replays its chunks from the start. It is abandoned once all
+        subscribers have gone away.
+        """
+        with self._lock:
+            flight = self._streams.get(key)
+            if flight:
+                self.coalesced += 1
+                with flight['cond']:
+                    flight['subscribers'] += 1
+            else:
+                flight = {'chunks': [], 'done': False, 'error': None, 'subscribers': 1, 'cond': threading.Condition()}
+                self._streams[key] = flight
+                self.leaders += 1
+                threading.Thread(target=self._produce, args=(key, flight, make_stream), daemon=True).start()
+        
+        position = 0
+        try:
+            while True:
+                with flight['cond']:
+                    while position >= len(flight['chunks']) and not flight['done']:
+                        flight['cond'].wait()
+                    new_chunks = flight['chunks'][position:]
+                    done, error = flight['done'], flight['error']
+                position += len(new_chunks)
+                for chunk in new_chunks:
+                    yield chunk
+                if done and position >= len(flight['chunks']):
+                    if error:
+                        raise error
+                    return
+        finally:
+            with flight['cond']:
+                flight['subscribers'] -= 1
+
+    def _produce(self, key, flight, make_stream):
+        stream = make_stream()
+        try:
+            for chunk in stream:
+                with flight['cond']:
+                    if not flight['subscribers']:
+                        # Everyone cancelled: stop generating
+                        stream.close()
+                        break
+                    flight['chunks'].append(chunk)
+                    flight['cond'].notify_all()
+        except Exception as e:
+            flight['error'] = e
+        finally:
+            with self._lock:
+                self._streams.pop(key, None)
+            with flight['cond']:
+                flight['done'] = True
+                flight['cond'].notify_all()
+
+    def stats(self):
+        """Return how many calls ran and how many were served by an in-flight call"""
+        return {'leaders': self.leaders, 'coalesced': self.coalesced}
+
+# Provider protection configuration: (requests per second, burst size)
+PROVIDER_RATE_LIMITS = {
+    'groq': (0.5, 10),           # 30 requests/minute, bursts cover a chunked long-trip plan
+    'serpapi': (1.0, 5),
+    'openweather': (1.0, 10),    # 60 calls/minute
+    'unsplash': (50 / 3600, 5),  # 50 requests/hour (demo tier)
+    'unsplash-images': (10.0, 20),  # Image CDN downloads, not counted against the API quota
+    'nominatim': (1.0, 1),       # 1 request/second usage policy
+    'ipinfo': (50000 / (30 * 24 * 3600), 20),
+    'ip-api': (0.75, 5)          # 45 requests/minute
+}
+# Override with e.g. RATE_LIMIT_GROQ="1,10" or RATE_LIMIT_IP_API="0.5,3"
+for _provider in PROVIDER_RATE_LIMITS:
+    _override = os.getenv(f"RATE_LIMIT_{_provider.upper().replace('-', '_')}")
+    if _override:
+        _rate, _burst = _override.split(",")
+        PROVIDER_RATE_LIMITS[_provider] = (float(_rate), int(_burst))
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "2"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+class ProviderUnavailable(RuntimeError):
+    """Raised instead of calling a provider that is rate limited or tripped open"""
+
+class TokenBucket:
+    """Thread-safe token bucket; callers wait briefly for a token or are rejected"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.waiting = 0
+        self.acquired = 0
+        self.rejected = 0
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, max_wait):
+        """Take one token, waiting up to max_wait seconds; returns False when rejected"""
+        deadline = time.monotonic() + max_wait
+        with self._cond:
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        self.acquired += 1
+                        return True
+                    wait_for = (1 - self.tokens) / self.rate
+                    if now + wait_for > deadline:
+                        self.rejected += 1
+                        return False
+                    self._cond.wait(wait_for)
+            finally:
+                self.waiting -= 1
+
+class CircuitBreaker:
+    """Fails fast after repeated failures, then lets a single half-open probe through"""
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may go ahead"""
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """Free the half-open probe slot without recording an outcome"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+class ProviderGuard:
+    """Rate limiter plus circuit breaker for one external provider"""
+
+    def __init__(self, provider, rate, capacity):
+        self.provider = provider
+        self.bucket = TokenBucket(rate, capacity)
+        self.breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+
+    def admit(self, max_wait=None):
+        """Raise ProviderUnavailable unless the breaker and the rate limiter let a call through
+        
+        max_wait (default RATE_LIMIT_MAX_WAIT_SECONDS) bounds the wait for a
+        rate limit token; background work can afford to queue longer.
+        """
+        if not self.breaker.allow():
+            raise ProviderUnavailable(f"{self.provider} is temporarily unavailable")
+        if not self.bucket.acquire(RATE_LIMIT_MAX_WAIT_SECONDS if max_wait is None else max_wait):
+            # Rate limited locally: not a provider failure
+            self.breaker.release_probe()
+            raise ProviderUnavailable(f"{self.provider} rate limit reached")
+
+    def stats(self):
+        return {
+            'state': self.breaker.state,
+            'failures': self.breaker.failures,
+            'rejected_open': self.breaker.rejected,
+            'rejected_rate_limited': self.bucket.rejected,
+            'queue_depth': self.bucket.waiting,
+            'calls': self.bucket.acquired,
+            'tokens': round(self.bucket.tokens, 2)
+        }
+
+# Offline geocoding configuration (GeoNames dumps from https://download.geonames.org/export/dump/)
+GAZETTEER_DIR = os.getenv("GAZETTEER_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+GAZETTEER_CITIES_FILE = os.getenv("GAZETTEER_CITIES_FILE", "cities15000.txt")
+REVERSE_GEOCODE_MAX_KM = float(os.getenv("REVERSE_GEOCODE_MAX_KM", "75"))
+NOMINATIM_FALLBACK = os.getenv("NOMINATIM_FALLBACK", "true").lower() == "true"
+EARTH_RADIUS_KM = 6371.0
+
+class Gazetteer:
+    """Place names and coordinates loaded from a GeoNames cities dump"""
+
+    def __init__(self, names, regions, countries, lats, lons, populations):
+        self.names = names
+        self.regions = regions
+        self.countries = countries
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.populations = np.asarray(populations, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.names)
+
+    def label(self, idx):
+        """Format a place as "City, Region, Country" """
+        parts = [self.names[idx], self.regions[idx], self.countries[idx]]
+        return ", ".join(part for part in parts if part)
+
+def _read_geonames_lookup(path, key_col, value_col):
+    """Read a GeoNames code -> name table, skipping comments"""
+    lookup = {}
+    if not os.path.exists(path):
+        return lookup
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) > max(key_col, value_col):
+                lookup[cols[key_col]] = cols[value_col]
+    return lookup
+
+def load_gazetteer(directory=GAZETTEER_DIR, cities_file=GAZETTEER_CITIES_FILE):
+    """Load the cities dump plus optional admin1 and country name tables, or None if absent"""
+    cities_path = os.path.join(directory, cities_file)
+    if not os.path.exists(cities_path):
+        return None
+    
+    admin1_names = _read_geonames_lookup(os.path.join(directory, "admin1CodesASCII.txt"), 0, 1)
+    country_names = _read_geonames_lookup(os.path.join(directory, "countryInfo.txt"), 0, 4)
+    
+    names, regions, countries, lats, lons, populations = [], [], [], [], [], []
+    with open(cities_path, encoding="utf-8") as f:
+        for line in f:
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) < 15:
+                continue
+            country_code = cols[8]
+            names.append(cols[1])
+            regions.append(admin1_names.get(f"{country_code}.{cols[10]}", ""))
+            countries.append(country_names.get(country_code, country_code))
+            lats.append(float(cols[4]))
+            lons.append(float(cols[5]))
+            populations.append(int(cols[14] or 0))
+    return Gazetteer(names, regions, countries, lats, lons, populations)
+
+class ReverseGeocoder:
+    """Nearest-place lookup over a gazetteer using fixed-size lat/lon grid buckets"""
+
+    def __init__(self, gazetteer, cell_degrees=1.0):
+        self.gazetteer = gazetteer
+        self.cell_degrees = cell_degrees
+        self.n_lon_cells = int(np.ceil(360 / cell_degrees))
+        
+        # Sort points by bucket so each bucket is a contiguous slice
+        lat_cells = np.floor((gazetteer.lats + 90) / cell_degrees).astype(np.int64)
+        lon_cells = np.floor((gazetteer.lons + 180) / cell_degrees).astype(np.int64) % self.n_lon_cells
+        cell_ids = lat_cells * self.n_lon_cells + lon_cells
+        self.order = np.argsort(cell_ids, kind="stable")
+        sorted_ids = cell_ids[self.order]
+        unique_ids, starts = np.unique(sorted_ids, return_index=True)
+        ends = np.append(starts[1:], len(sorted_ids))
+        self.buckets = {int(cell): (int(start), int(end)) for cell, start, end in zip(unique_ids, starts, ends)}
+        
+        self.lat_rad = np.radians(gazetteer.lats[self.order])
+        self.lon_rad = np.radians(gazetteer.lons[self.order])
+
+    def _candidates(self, lat, lon, max_km):
+        """Indices (into the sorted arrays) of points in buckets within max_km"""
+        lat_span = int(np.ceil(max_km / 111.0 / self.cell_degrees))
+        cos_lat = max(np.cos(np.radians(min(abs(lat) + lat_span * self.cell_degrees, 89.9))), 1e-6)
+        lon_span = min(int(np.ceil(max_km / (111.0 * cos_lat) / self.cell_degrees)), self.n_lon_cells // 2)
+        
+        lat_cell = int(np.floor((lat + 90) / self.cell_degrees))
+        lon_cell = int(np.floor((lon + 180) / self.cell_degrees))
+        slices = []
+        for lat_idx in range(lat_cell - lat_span, lat_cell + lat_span + 1):
+            for lon_idx in range(lon_cell - lon_span, lon_cell + lon_span + 1):
+                bucket = self.buckets.get(lat_idx * self.n_lon_cells + lon_idx % self.n_lon_cells)
+                if bucket:
+                    slices.append(np.arange(bucket[0], bucket[1]))
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def nearest(self, lat, lon, max_km=REVERSE_GEOCODE_MAX_KM):
+        """Return the gazetteer index of the closest place within max_km, or None"""
+        candidates = self._candidates(lat, lon, max_km)
+        if not len(candidates):
+            return None
+        
+        # Vectorized haversine distance to every candidate
+        lat1, lon1 = np.radians(lat), np.radians(lon)
+        dlat = self.lat_rad[candidates] - lat1
+        dlon = self.lon_rad[candidates] - lon1
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(self.lat_rad[candidates]) * np.sin(dlon / 2) ** 2
+        distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+        best = int(np.argmin(distances))
+        if distances[best] > max_km:
+            return None
+        return int(self.order[candidates[best]])
+
+    def lookup(self, lat, lon, max_km=REVERSE_GEOCODE_MAX_KM):
+        """Return "City, Region, Country" for the closest place, or None"""
+        idx = self.nearest(lat, lon, max_km)
+        return self.gazetteer.label(idx) if idx is not None else None
+
+def normalize_place_name(name):
+    """Casefold and strip accents so "Zürich" and "zurich" share an index key"""
+    decomposed = unicodedata.normalize("NFKD", str(name or ""))
+    return " ".join("".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold().split())
+
+class PlaceIndex:
+    """Prefix index over gazetteer names using a sorted key array and bisect"""
+
+    def __init__(self, gazetteer):
+        self.gazetteer = gazetteer
+        keys = [normalize_place_name(name) for name in gazetteer.names]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.keys = [keys[i] for i in order]
+        self.ids = np.asarray(order, dtype=np.int64)
+        self.populations = gazetteer.populations[self.ids]
+        self.regions = [normalize_place_name(region) for region in gazetteer.regions]
+        self.countries = [normalize_place_name(country) for country in gazetteer.countries]
+
+    def suggest(self, text, limit=8):
+        """Return gazetteer indices of the most populous places whose name starts with text"""
+        prefix = normalize_place_name(str(text or "").split(",")[0])
+        if not prefix:
+            return []
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + "\uffff", lo)
+        if lo == hi:
+            return []
+        
+        populations = self.populations[lo:hi]
+        if hi - lo > limit:
+            top = np.argpartition(-populations, limit)[:limit]
+        else:
+            top = np.arange(hi - lo)
+        top = top[np.argsort(-populations[top], kind="stable")]
+        return [int(self.ids[lo + i]) for i in top]
+
+    def resolve(self, text):
+        """Return the gazetteer index for "City[, Region][, Country]" text, or None"""
+        parts = [normalize_place_name(part) for part in str(text or "").split(",")]
+        if not parts[0]:
+            return None
+        lo = bisect_left(self.keys, parts[0])
+        hi = bisect_right(self.keys, parts[0], lo)
+        if lo == hi:
+            return None
+        
+        candidates = [int(idx) for idx in self.ids[lo:hi]]
+        qualifiers = [part for part in parts[1:] if part]
+        if qualifiers:
+            # Prefer places whose region or country matches every qualifier
+            matching = [
+                idx for idx in candidates
+                if all(q in (self.regions[idx], self.countries[idx]) for q in qualifiers)
+            ]
+            candidates = matching or candidates
+        return max(candidates, key=lambda idx: self.gazetteer.populations[idx])
+
+# IP geolocation configuration
+GEOIP_DB_PATH = os.getenv("GEOIP_DB_PATH", os.path.join(GAZETTEER_DIR, "GeoLite2-City.mmdb"))
+IP_LOCATION_CACHE_TTL_SECONDS = int(os.getenv("IP_LOCATION_CACHE_TTL_SECONDS", str(24 * 3600)))
+# Seconds to give ipinfo.io before ip-api.com is asked as well
+IP_LOOKUP_FALLBACK_SECONDS = float(os.getenv("IP_LOOKUP_FALLBACK_SECONDS", "2"))
+
+# Image gallery configuration
+IMAGE_CACHE_TTL_SECONDS = int(os.getenv("IMAGE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "thumbnails"))
+THUMBNAIL_SIZE = (480, 320)
+THUMBNAIL_MAX_FILES = int(os.getenv("THUMBNAIL_MAX_FILES", "2000"))
+THUMBNAIL_HOSTS = {"images.unsplash.com", "plus.unsplash.com"}
+
+# HTTP client configuration
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+HTTP_BACKOFF_BASE_SECONDS = float(os.getenv("HTTP_BACKOFF_BASE_SECONDS", "0.5"))
+HTTP_BACKOFF_MAX_SECONDS = float(os.getenv("HTTP_BACKOFF_MAX_SECONDS", "4"))
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+PROVIDER_TIMEOUTS = {
+    'groq': 60,
+    'serpapi': 10,
+    'openweather': 10,
+    'unsplash': 10,
+    'unsplash-images': 10,
+    'ipinfo': 5,
+    'ip-api': 5
+}
+
+# Provider endpoints; override to point at local stubs (see benchmark.py).
+# The Groq SDK reads GROQ_BASE_URL itself.
+PROVIDER_BASE_URLS = {
+    'serpapi': os.getenv("SERPAPI_BASE_URL", "https://serpapi.com"),
+    'openweather': os.getenv("OPENWEATHER_BASE_URL", "http://api.openweathermap.org"),
+    'unsplash': os.getenv("UNSPLASH_BASE_URL", "https://api.unsplash.com"),
+    'nominatim': os.getenv("NOMINATIM_BASE_URL", "https://nominatim.openstreetmap.org"),
+    'ipinfo': os.getenv("IPINFO_BASE_URL", "https://ipinfo.io"),
+    'ip-api': os.getenv("IP_API_BASE_URL", "http://ip-api.com")
+}
+
+# Concurrent fetch configuration
+FETCH_DEADLINE_SECONDS = float(os.getenv("FETCH_DEADLINE_SECONDS", "8"))
+FETCH_MAX_WORKERS = int(os.getenv("FETCH_MAX_WORKERS", "16"))
+
+# Shared resources
+
+@functools.lru_cache(maxsize=None)
+def get_plan_cache():
+    """Process-wide plan cache shared by all sessions"""
+    return PlanCache(PLAN_CACHE_PATH, PLAN_CACHE_TTL_SECONDS, PLAN_CACHE_MAX_ENTRIES)
+
+@functools.lru_cache(maxsize=None)
+def get_run_timings():
+    """Process-wide UI run timings"""
+    return RunTimings()
+
+@functools.lru_cache(maxsize=None)
+def get_metrics():
+    """Process-wide counters and histograms"""
+    return Metrics()
+
+@functools.lru_cache(maxsize=None)
+def start_metrics_server(port=METRICS_PORT):
+    """Serve render_metrics() at /metrics from a background thread; None when disabled"""
+    if not port:
+        return None
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if urlparse(self.path).path != "/metrics":
+                self.send_error(404)
+                return
+            body = render_metrics().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, *args):
+            pass
+    
+    try:
+        server = ThreadingHTTPServer((METRICS_HOST, port), MetricsHandler)
+    except OSError as e:
+        logger.warning("Metrics server not started on port %s: %s", port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+@functools.lru_cache(maxsize=None)
+def get_saved_plan_store():
+    """Process-wide store of saved plans"""
+    return SavedPlanStore(SAVED_PLANS_PATH)
+
+@functools.lru_cache(maxsize=None)
+def get_http_session():
+    """Process-wide HTTP session that keeps connections alive per host"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=len(PROVIDER_TIMEOUTS), pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+@functools.lru_cache(maxsize=32)
+def get_groq_client(api_key):
+    """Reuse one Groq client (and its connection pool) per API key"""
+    from groq import Groq
+    return Groq(api_key=api_key, timeout=PROVIDER_TIMEOUTS['groq'], max_retries=HTTP_MAX_RETRIES)
+
+@functools.lru_cache(maxsize=None)
+def get_gazetteer():
+    """Process-wide gazetteer, loaded once from GAZETTEER_DIR"""
+    return load_gazetteer()
+
+@functools.lru_cache(maxsize=None)
+def get_reverse_geocoder():
+    """Process-wide offline reverse geocoder, or None without a gazetteer"""
+    gazetteer = get_gazetteer()
+    return ReverseGeocoder(gazetteer) if gazetteer else None
+
+@functools.lru_cache(maxsize=None)
+def get_place_index():
+    """Process-wide destination prefix index, or None without a gazetteer"""
+    gazetteer = get_gazetteer()
+    return PlaceIndex(gazetteer) if gazetteer else None
+
+@functools.lru_cache(maxsize=None)
+def get_geoip_reader():
+    """Shared GeoIP database reader, or None if geoip2 or the database is missing"""
+    if not os.path.exists(GEOIP_DB_PATH):
+        return None
+    geoip2_database = optional_import("geoip2.database")
+    return geoip2_database.Reader(GEOIP_DB_PATH) if geoip2_database else None
+
+@functools.lru_cache(maxsize=None)
+def get_ip_location_cache():
+    """Process-wide IP geolocation cache keyed by address prefix"""
+    return TTLCache(IP_LOCATION_CACHE_TTL_SECONDS)
+
+@functools.lru_cache(maxsize=None)
+def get_nominatim():
+    """Shared Nominatim client used as the online fallback"""
+    from geopy.geocoders import Nominatim
+    endpoint = urlparse(PROVIDER_BASE_URLS['nominatim'])
+    return Nominatim(user_agent="travel_planner", domain=endpoint.netloc, scheme=endpoint.scheme)
+
+@functools.lru_cache(maxsize=None)
+def get_weather_cache():
+    """Process-wide weather cache shared by all sessions"""
+    return TTLCache(WEATHER_CACHE_TTL_SECONDS)
+
+@functools.lru_cache(maxsize=None)
+def get_image_cache():
+    """Process-wide image search results, keyed by location"""
+    return TTLCache(IMAGE_CACHE_TTL_SECONDS)
+
+@functools.lru_cache(maxsize=None)
+def get_single_flight():
+    """Process-wide single-flight group for provider and LLM calls"""
+    return SingleFlight()
+
+@functools.lru_cache(maxsize=None)
+def get_provider_guard(provider):
+    """Process-wide rate limiter and circuit breaker for a provider"""
+    rate, capacity = PROVIDER_RATE_LIMITS.get(provider, (1.0, 5))
+    return ProviderGuard(provider, rate, capacity)
+
+def provider_stats():
+    """Rate limiter and circuit breaker state for every provider"""
+    return {provider: get_provider_guard(provider).stats() for provider in PROVIDER_RATE_LIMITS}
+
+@contextmanager
+def guarded_call(provider, max_wait=None):
+    """Admit a call through the provider guard and record its outcome"""
+    guard = get_provider_guard(provider)
+    guard.admit(max_wait)
+    succeeded = False
+    start = time.perf_counter()
+    try:
+        yield
+        succeeded = True
+    except Exception as e:
+        guard.breaker.record_failure()
+        record_provider_call(provider, start, type(e).__name__)
+        raise
+    finally:
+        if succeeded:
+            record_provider_call(provider, start)
+            guard.breaker.record_success()
+        else:
+            # Abandoned (e.g. a cancelled stream): neither success nor failure
+            guard.breaker.release_probe()
+
+@functools.lru_cache(maxsize=None)
+def get_fetch_executor():
+    """Process-wide thread pool for provider lookups"""
+    return ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS, thread_name_prefix="provider-fetch")
+
+@functools.lru_cache(maxsize=None)
+def get_llm_executor():
+    """Process-wide thread pool for structured plan completions, kept apart from the short provider lookups"""
+    return ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS, thread_name_prefix="llm-chunk")
+
+# Cache keys
+
+def _normalize_text(value):
+    """Lowercase and collapse whitespace so trivially different inputs share a key"""
+    return " ".join(str(value or "").lower().split())
+
+def make_plan_cache_key(destination, duration, budget, travel_style, from_location=None, variant=None):
+    """Build a content hash of the plan inputs, model and prompt version"""
+    payload = {
+        'destination': _normalize_text(destination),
+        'duration': int(duration),
+        'budget': _normalize_text(budget),
+        'travel_style': sorted(_normalize_text(style) for style in (travel_style or [])),
+        'from_location': _normalize_text(from_location),
+        'model': PLAN_MODEL,
+        'prompt_version': PLAN_PROMPT_VERSION
+    }
+    if variant:
+        # e.g. "structured" plans are cached separately from markdown plans
+        payload['variant'] = variant
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def weather_grid_cell(lat, lon, grid=WEATHER_GRID_DEGREES):
+    """Snap coordinates to a grid cell so nearby clicks share one forecast"""
+    return (round(lat / grid), round(lon / grid))
+
+def ip_cache_key(ip):
+    """Group addresses by /24 (IPv4) or /64 (IPv6) prefix for caching"""
+    if not ip:
+        return "server"
+    prefix = 24 if ipaddress.ip_address(ip).version == 4 else 64
+    return str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False))
+
+# HTTP helpers
+
+def _retry_delay(attempt, response=None):
+    """Jittered exponential backoff, honouring a numeric Retry-After header"""
+    if response is not None:
+        retry_after = response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            return min(float(retry_after), HTTP_BACKOFF_MAX_SECONDS)
+    return random.uniform(0, min(HTTP_BACKOFF_MAX_SECONDS, HTTP_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+def http_get(provider, url, params=None, headers=None):
+    """GET through the shared session with the provider's timeout and retries on 429/5xx
+    
+    The breaker admits and records each logical call once, like guarded_call;
+    retries only take another rate limit token.
+    """
+    session = get_http_session()
+    guard = get_provider_guard(provider)
+    timeout = PROVIDER_TIMEOUTS.get(provider, 10)
+    guard.admit()
+    succeeded = None
+    try:
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            if attempt and not guard.bucket.acquire(RATE_LIMIT_MAX_WAIT_SECONDS):
+                raise ProviderUnavailable(f"{provider} rate limit reached")
+            start = time.perf_counter()
+            try:
+                response = session.get(url, params=params, headers=headers, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                succeeded = False
+                record_provider_call(provider, start, type(e).__name__)
+                if attempt == HTTP_MAX_RETRIES:
+                    raise
+                time.sleep(_retry_delay(attempt))
+                continue
+            record_provider_call(provider, start, str(response.status_code) if response.status_code >= 400 else None)
+            succeeded = response.status_code not in RETRY_STATUS_CODES
+            if succeeded or attempt == HTTP_MAX_RETRIES:
+                return response
+            time.sleep(_retry_delay(attempt, response))
+    finally:
+        # One breaker outcome per call, from its last attempt
+        if succeeded:
+            guard.breaker.record_success()
+        elif succeeded is False:
+            guard.breaker.record_failure()
+        else:
+            guard.breaker.release_probe()
+
+# Provider lookups
+def summarize_forecast(weather_data):
+    """Reduce a 3-hour slot forecast to current conditions plus per-day aggregates
+    
+    Days follow the forecast location's local time. Each day has its min/max/mean
+    temperature, the highest precipitation probability of its slots and the most
+    frequent condition (e.g. "Rain").
+    """
+    slots = weather_data.get('list') or []
+    if not slots:
+        return None
+    utc_offset = (weather_data.get('city') or {}).get('timezone', 0)
+    
+    # Slot arrays, aggregated per day with grouped NumPy reductions
+    days = (np.array([slot['dt'] for slot in slots], dtype=np.int64) + utc_offset) // 86400
+    temps = np.array([slot['main']['temp'] for slot in slots], dtype=np.float64)
+    temp_mins = np.array([slot['main'].get('temp_min', slot['main']['temp']) for slot in slots], dtype=np.float64)
+    temp_maxs = np.array([slot['main'].get('temp_max', slot['main']['temp']) for slot in slots], dtype=np.float64)
+    pops = np.array([slot.get('pop', 0.0) for slot in slots], dtype=np.float64)
+    conditions, condition_idx = np.unique([slot['weather'][0]['main'] for slot in slots], return_inverse=True)
+    
+    day_values, day_idx, slot_counts = np.unique(days, return_inverse=True, return_counts=True)
+    n_days = len(day_values)
+    day_mins = np.full(n_days, np.inf)
+    np.minimum.at(day_mins, day_idx, temp_mins)
+    day_maxs = np.full(n_days, -np.inf)
+    np.maximum.at(day_maxs, day_idx, temp_maxs)
+    day_means = np.bincount(day_idx, weights=temps, minlength=n_days) / slot_counts
+    day_pops = np.zeros(n_days)
+    np.maximum.at(day_pops, day_idx, pops)
+    condition_counts = np.zeros((n_days, len(conditions)), dtype=np.int64)
+    np.add.at(condition_counts, (day_idx, condition_idx), 1)
+    dominant = conditions[condition_counts.argmax(axis=1)]
+    
+    current = slots[0]
+    return {
+        'current': {
+            'temp': float(current['main']['temp']),
+            'humidity': current['main'].get('humidity'),
+            'description': current['weather'][0]['description'],
+            'condition': current['weather'][0]['main']
+        },
+        'daily': [
+            {
+                'date': time.strftime("%Y-%m-%d", time.gmtime(int(day) * 86400)),
+                'temp_min': float(day_mins[i]),
+                'temp_max': float(day_maxs[i]),
+                'temp_mean': float(day_means[i]),
+                'pop': float(day_pops[i]),
+                'condition': str(dominant[i]),
+                'slots': int(slot_counts[i])
+            }
+            for i, day in enumerate(day_values)
+        ]
+    }
+
+@traced()
+def get_weather_data(lat, lon, location_name):
+    """Fetch the 5-day forecast from OpenWeatherMap as a daily summary, cached per coordinate grid cell"""
+    try:
+        api_key = get_api_key("OPENWEATHER_API_KEY")
+        if not api_key:
+            return None
+        
+        weather_cache = get_weather_cache()
+        cell = weather_grid_cell(lat, lon)
+        cached_weather = weather_cache.get(cell)
+        if cached_weather:
+            return cached_weather
+        
+        url = f"{PROVIDER_BASE_URLS['openweather']}/data/2.5/forecast"
+        params = {
+            'lat': lat,
+            'lon': lon,
+            'appid': api_key,
+            'units': 'metric',
+            'cnt': WEATHER_FORECAST_SLOTS
+        }
+        
+        def fetch():
+            response = http_get('openweather', url, params=params)
+            if response.status_code == 200:
+                # Only the compact summary is cached and handed out
+                forecast = summarize_forecast(response.json())
+                if forecast:
+                    weather_cache.set(cell, forecast)
+                return forecast
+            return None
+        
+        return get_single_flight().do(f"weather:{cell}", fetch)
+    except Exception as e:
+        logger.warning("Weather API error: %s", e)
+        return None
+
+@traced()
+def get_location_images(location_name):
+    """Fetch Unsplash images for a location, cached per location"""
+    try:
+        api_key = get_api_key("UNSPLASH_ACCESS_KEY")
+        if not api_key:
+            return []
+
+        location_clean = location_name.split(",")[0].strip()
+        cache_key = _normalize_text(location_clean)
+        image_cache = get_image_cache()
+        cached_images = image_cache.get(cache_key)
+        if cached_images is not None:
+            return cached_images
+        
+        # A fixed query keeps results cacheable
+        query = f"{location_clean} travel landmark"
+
+        url = f"{PROVIDER_BASE_URLS['unsplash']}/search/photos"
+        headers = {"Authorization": f"Client-ID {api_key}"}
+        params = {
+            'query': query,
+            'per_page': 6,
+            'orientation': 'landscape'
+        }
+
+        def fetch():
+            response = http_get('unsplash', url, params=params, headers=headers)
+            if response.status_code == 200:
+                data = response.json()
+                images = [photo['urls']['regular'] for photo in data['results']]
+                image_cache.set(cache_key, images)
+                return images
+            return []
+        
+        return get_single_flight().do(f"images:{cache_key}", fetch)
+    except Exception as e:
+        logger.warning("Image API error: %s", e)
+        return []
+
+def thumbnail_name(url, size=THUMBNAIL_SIZE):
+    """File name of the cached thumbnail for an image URL"""
+    return hashlib.sha256(f"{url}|{size[0]}x{size[1]}".encode()).hexdigest()[:32] + ".jpg"
+
+def _thumbnail_source_url(url, size):
+    """Ask the Unsplash CDN for a smaller rendition than the full 'regular' size"""
+    parsed = urlparse(url)
+    params = dict(parse_qsl(parsed.query))
+    params['w'] = str(size[0] * 2)  # Leave headroom for cropping and high-DPI screens
+    return parsed._replace(query=urlencode(params)).geturl()
+
+def _prune_files(directory, suffix, max_files, keep):
+    """Drop the oldest files with suffix in directory beyond max_files, except keep"""
+    entries = [entry for entry in os.scandir(directory) if entry.name.endswith(suffix) and entry.path != keep]
+    if len(entries) < max_files:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:len(entries) + 1 - max_files]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+@traced()
+def get_thumbnail(url, size=THUMBNAIL_SIZE):
+    """Return the path of a resized, disk-cached JPEG thumbnail of an image URL, or None
+    
+    Only Unsplash image hosts are fetched. Without Pillow no thumbnails are
+    made and callers fall back to the original URL.
+    """
+    image_ops = optional_import("PIL.ImageOps")
+    if image_ops is None or urlparse(url).hostname not in THUMBNAIL_HOSTS:
+        return None
+    name = thumbnail_name(url, size)
+    path = os.path.join(THUMBNAIL_DIR, name)
+    if os.path.exists(path):
+        return path
+    
+    def fetch():
+        response = http_get('unsplash-images', _thumbnail_source_url(url, size))
+        if response.status_code != 200:
+            return None
+        with image_ops.Image.open(BytesIO(response.content)) as image:
+            thumbnail = image_ops.fit(image.convert("RGB"), size)
+        os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+        # Write then rename so readers never see a partial file
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        thumbnail.save(temp_path, "JPEG", quality=80, optimize=True, progressive=True)
+        os.replace(temp_path, path)
+        _prune_files(THUMBNAIL_DIR, ".jpg", THUMBNAIL_MAX_FILES, keep=path)
+        return path
+    
+    try:
+        return get_single_flight().do(f"thumbnail:{name}", fetch)
+    except Exception as e:
+        logger.warning("Thumbnail error for %s: %s", url, e)
+        return None
+
+@traced()
+def search_destinations(query):
+    """Search for destination information using SerpAPI"""
+    try:
+        api_key = get_api_key("SERP_API_KEY")
+        if not api_key:
+            return None
+        
+        url = f"{PROVIDER_BASE_URLS['serpapi']}/search"
+        params = {
+            'q': f"{query} travel guide attractions",
+            'api_key': api_key,
+            'engine': 'google'
+        }
+        
+        def fetch():
+            response = http_get('serpapi', url, params=params)
+            if response.status_code == 200:
+                return response.json()
+            return None
+        
+        return get_single_flight().do(f"search:{_normalize_text(query)}", fetch)
+    except Exception as e:
+        logger.warning("Search API error: %s", e)
+        return None
+
+
+def _nominatim_reverse(geolocator, coordinate_string):
+    with guarded_call('nominatim'):
+        return geolocator.reverse(coordinate_string)
+
+@traced()
+def reverse_geocode(lat, lon):
+    """Get location name from coordinates, offline first with Nominatim as fallback"""
+    try:
+        geocoder = get_reverse_geocoder()
+        if geocoder:
+            location_name = geocoder.lookup(lat, lon)
+            if location_name:
+                return location_name
+        if not NOMINATIM_FALLBACK:
+            return f"Location at {lat:.4f}, {lon:.4f}"
+        
+        geolocator = get_nominatim()
+        coordinate_string = f"{lat}, {lon}"
+        location = get_single_flight().do(f"geocode:{lat:.4f},{lon:.4f}", lambda: _nominatim_reverse(geolocator, coordinate_string))
+        if location:
+            return str(location)
+        return f"Location at {lat:.4f}, {lon:.4f}"
+    except Exception as e:
+        return f"Location at {lat:.4f}, {lon:.4f}"
+
+def suggest_destinations(text, limit=8):
+    """Suggest gazetteer places for partially typed destination text"""
+    place_index = get_place_index()
+    if not place_index or len(str(text or "").strip()) < 2:
+        return []
+    return place_index.suggest(text, limit)
+
+@traced()
+def forward_geocode(text):
+    """Resolve destination text to a place label and coordinates without network calls"""
+    place_index = get_place_index()
+    if not place_index:
+        return None
+    idx = place_index.resolve(text)
+    if idx is None:
+        return None
+    gazetteer = place_index.gazetteer
+    return {
+        'location': gazetteer.label(idx),
+        'latitude': float(gazetteer.lats[idx]),
+        'longitude': float(gazetteer.lons[idx])
+    }
+
+def _location_record(city, region, country, latitude, longitude, raw_data):
+    """Build the location dict stored in session state"""
+    location_parts = [part for part in [city, region, country] if part]
+    return {
+        'location': ', '.join(location_parts) if location_parts else 'Unknown Location',
+        'city': city,
+        'region': region,
+        'country': country,
+        'latitude': latitude,
+        'longitude': longitude,
+        'raw_data': raw_data
+    }
+
+def lookup_ip_local(ip):
+    """Look up an IP in the local GeoIP database file, if one is installed"""
+    reader = get_geoip_reader()
+    if not reader or not ip:
+        return None
+    try:
+        response = reader.city(ip)
+    except Exception:
+        return None
+    return _location_record(
+        response.city.name or '',
+        response.subdivisions.most_specific.name or '',
+        response.country.iso_code or '',
+        response.location.latitude,
+        response.location.longitude,
+        {'source': 'geoip'}
+    )
+
+def _lookup_ipinfo(ip):
+    """Look up an IP (or the caller's own IP) with ipinfo.io (free tier: 50,000 requests/month)"""
+    try:
+        base_url = PROVIDER_BASE_URLS['ipinfo']
+        response = http_get('ipinfo', f"{base_url}/{ip}/json" if ip else f"{base_url}/json")
+        if response.status_code == 200:
+            data = response.json()
+            
+            # Get coordinates if available
+            loc = data.get('loc', '').split(',')
+            lat, lon = (float(loc[0]), float(loc[1])) if len(loc) == 2 else (None, None)
+            
+            return _location_record(data.get('city', ''), data.get('region', ''), data.get('country', ''), lat, lon, data)
+    except Exception as e:
+        pass
+    return None
+
+def _lookup_ip_api(ip):
+    """Look up an IP (or the caller's own IP) with ip-api.com (free tier: 1000 requests/hour)"""
+    try:
+        response = http_get('ip-api', f"{PROVIDER_BASE_URLS['ip-api']}/json/{ip or ''}")
+        if response.status_code == 200:
+            data = response.json()
+            if data.get('status') == 'success':
+                return _location_record(
+                    data.get('city', ''), data.get('regionName', ''), data.get('country', ''),
+                    data.get('lat'), data.get('lon'), data
+                )
+    except Exception as e:
+        pass
+    return None
+
+def _lookup_ip_web(ip):
+    """Look up an IP with ipinfo.io, falling back to ip-api.com
+    
+    ip-api.com is only called when ipinfo.io fails or has not answered within
+    IP_LOOKUP_FALLBACK_SECONDS. Both share one deadline; ipinfo.io still wins
+    when it answers before the fallback does.
+    """
+    deadline = time.monotonic() + PROVIDER_TIMEOUTS['ipinfo']
+    executor = get_fetch_executor()
+    trace = current_trace()
+    primary = executor.submit(_run_in_trace, trace, _lookup_ipinfo, (ip,))
+    wait([primary], timeout=min(IP_LOOKUP_FALLBACK_SECONDS, PROVIDER_TIMEOUTS['ipinfo']))
+    if primary.done() and primary.result():
+        return primary.result()
+    
+    fallback = executor.submit(_run_in_trace, trace, _lookup_ip_api, (ip,))
+    pending = {primary, fallback}
+    while pending:
+        done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in (primary, fallback):
+            if future in done and future.result():
+                return future.result()
+    return None
+
+@traced()
+def get_user_location_from_ip(ip=None):
+    """Get user's current location using IP geolocation
+    
+    Results are cached per address prefix. A local GeoIP database is tried
+    first; otherwise ipinfo.io is queried, with ip-api.com as its fallback.
+    """
+    ip_cache = get_ip_location_cache()
+    cache_key = ip_cache_key(ip)
+    cached_location = ip_cache.get(cache_key)
+    if cached_location:
+        return cached_location
+    
+    def lookup():
+        location_data = lookup_ip_local(ip)
+        if not location_data:
+            location_data = _lookup_ip_web(ip)
+        if location_data:
+            ip_cache.set(cache_key, location_data)
+        return location_data
+    
+    location_data = get_single_flight().do(f"ip:{cache_key}", lookup)
+    if location_data:
+        return location_data
+    
+    # Return default if all methods fail
+    return {
+        'location': 'Location not detected',
+        'city': '',
+        'region': '',
+        'country': '',
+        'latitude': None,
+        'longitude': None,
+        'raw_data': {}
+    }
+
+# Concurrent fetching
+def _run_in_trace(trace, func, args):
+    """Run func on a worker thread with the caller's run trace active"""
+    _trace_state.trace = trace
+    try:
+        return func(*args)
+    finally:
+        _trace_state.trace = None
+
+def fetch_concurrently(tasks, deadline=FETCH_DEADLINE_SECONDS):
+    """Run independent provider calls in parallel and return whatever finished before the deadline
+    
+    tasks maps a name to a (function, args) tuple. Calls that fail or miss the
+    deadline are reported as None so callers can degrade gracefully.
+    """
+    if not tasks:
+        return {}
+    
+    executor = get_fetch_executor()
+    trace = current_trace()
+    futures = {name: executor.submit(_run_in_trace, trace, func, args) for name, (func, args) in tasks.items()}
+    wait(futures.values(), timeout=deadline)
+    
+    results = {}
+    for name, future in futures.items():
+        if future.done() and not future.exception():
+            results[name] = future.result()
+        else:
+            # Slow provider: drop its result, it finishes in the background
+            future.cancel()
+            results[name] = None
+    return results
+
+def fetch_destination_context(destination, coords=None, include_images=False):
+    """Fetch search, weather and image context for a destination in one parallel round"""
+    if coords is None:
+        place = forward_geocode(destination)
+        coords = (place['latitude'], place['longitude']) if place else None
+    tasks = {}
+    if get_api_key("SERP_API_KEY"):
+        tasks['search'] = (search_destinations, (destination,))
+    if coords and get_api_key("OPENWEATHER_API_KEY"):
+        tasks['weather'] = (get_weather_data, (coords[0], coords[1], destination))
+    if include_images and get_api_key("UNSPLASH_ACCESS_KEY"):
+        tasks['images'] = (get_location_images, (destination.split(",")[0].strip(),))
+    return fetch_concurrently(tasks)
+
+# Speech synthesis
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "smarttrip_tts"))
+TTS_RATE = int(os.getenv("TTS_RATE", "150"))
+TTS_VOLUME = float(os.getenv("TTS_VOLUME", "0.8"))
+TTS_VOICE_INDEX = int(os.getenv("TTS_VOICE_INDEX", "0"))
+TTS_MAX_PENDING = int(os.getenv("TTS_MAX_PENDING", "8"))
+TTS_MAX_FILES = int(os.getenv("TTS_MAX_FILES", "500"))
+TTS_RETRY_SECONDS = 600  # After a failed synthesis, e.g. no speech engine installed
+
+_speech_lock = threading.Lock()
+_speech_jobs = {}
+_speech_failures = {}
+
+@functools.lru_cache(maxsize=None)
+def get_tts_executor():
+    """Single worker thread for speech synthesis (pyttsx3 is not thread-safe)"""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts")
+
+def speech_path(text, rate=TTS_RATE, volume=TTS_VOLUME, voice_index=TTS_VOICE_INDEX):
+    """Cache file for text spoken with the given voice settings"""
+    key = json.dumps([text, rate, volume, voice_index])
+    return os.path.join(TTS_CACHE_DIR, hashlib.sha256(key.encode()).hexdigest()[:32] + ".wav")
+
+def _synthesize(text, path, rate, volume, voice_index):
+    """Render text to a WAV file; runs on the TTS worker"""
+    tts = optional_import("pyttsx3").init()
+    tts.setProperty('rate', rate)
+    tts.setProperty('volume', volume)
+    voices = tts.getProperty('voices')
+    if voices:
+        tts.setProperty('voice', voices[min(voice_index, len(voices) - 1)].id)
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp.wav"
+    tts.save_to_file(text, temp_path)
+    tts.runAndWait()
+    if not os.path.exists(temp_path) or not os.path.getsize(temp_path):
+        raise RuntimeError("speech engine produced no audio")
+    os.replace(temp_path, path)
+    # Every distinct summary adds a file; keep only the most recent ones
+    _prune_files(TTS_CACHE_DIR, ".wav", TTS_MAX_FILES, keep=path)
+    return path
+
+def get_speech(text, wait=0.0, rate=TTS_RATE, volume=TTS_VOLUME, voice_index=TTS_VOICE_INDEX):
+    """Return the path of a cached WAV rendering of text, or None if not ready
+    
+    Uncached texts are queued once on the TTS worker; wait is how long to
+    block for the result. At most TTS_MAX_PENDING syntheses are queued.
+    """
+    path = speech_path(text, rate, volume, voice_index)
+    if os.path.exists(path):
+        try:
+            # Recently played clips (e.g. the welcome message) are pruned last
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+    if optional_import("pyttsx3") is None:
+        return None
+    
+    submitted = False
+    with _speech_lock:
+        future = _speech_jobs.get(path)
+        if future is None:
+            failed_at = _speech_failures.get(path)
+            if failed_at and time.time() - failed_at < TTS_RETRY_SECONDS:
+                return None
+            if len(_speech_jobs) >= TTS_MAX_PENDING:
+                return None
+            future = get_tts_executor().submit(_synthesize, text, path, rate, volume, voice_index)
+            _speech_jobs[path] = future
+            submitted = True
+    
+    if submitted:
+        def done(finished):
+            with _speech_lock:
+                _speech_jobs.pop(path, None)
+                if finished.exception() is not None:
+                    logger.warning("Speech synthesis failed: %s", finished.exception())
+                    _speech_failures[path] = time.time()
+        
+        # Registered outside the lock: a job that already finished runs done() right here
+        future.add_done_callback(done)
+    
+    try:
+        return future.result(timeout=wait) if wait else None
+    except Exception:
+        # Still running (it stays queued for a later call) or failed
+        return None
+
+def speech_pending(text, rate=TTS_RATE, volume=TTS_VOLUME, voice_index=TTS_VOICE_INDEX):
+    """Whether a synthesis of text is queued or running"""
+    with _speech_lock:
+        return speech_path(text, rate, volume, voice_index) in _speech_jobs
+
+# Plan reuse
+PLAN_REUSE_ENABLED = os.getenv("PLAN_REUSE_ENABLED", "1") == "1"
+PLAN_REUSE_DESTINATION_THRESHOLD = float(os.getenv("PLAN_REUSE_DESTINATION_THRESHOLD", "0.9"))
+PLAN_REUSE_DRAFT_THRESHOLD = float(os.getenv("PLAN_REUSE_DRAFT_THRESHOLD", "0.6"))
+PLAN_REUSE_MAX_KM = float(os.getenv("PLAN_REUSE_MAX_KM", "25"))
+PLAN_REUSE_NAME_DIMENSIONS = 256
+PLAN_REUSE_STYLE_DIMENSIONS = 64
+
+def _hashed_vector(features, dimensions):
+    """L2-normalised bag of hashed features"""
+    vector = np.zeros(dimensions)
+    for feature in features:
+        vector[zlib.crc32(feature.encode()) % dimensions] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def _name_vector(name):
+    """Character trigram vector of a normalised place name"""
+    padded = f" {normalize_place_name(name)} "
+    return _hashed_vector([padded[i:i + 3] for i in range(len(padded) - 2)], PLAN_REUSE_NAME_DIMENSIONS)
+
+def _plan_params(destination, duration, budget, travel_style, from_location=None):
+    """Request parameters stored alongside a plan for similarity search"""
+    return {
+        'destination': destination,
+        'duration': int(duration),
+        'budget': budget,
+        'travel_style': sorted(travel_style or []),
+        'from_location': from_location
+    }
+
+@dataclass(slots=True)
+class PlanMatch:
+    key: str
+    plan_content: str
+    params: dict
+    destination_similarity: float
+    score: float
+    exact: bool
+
+class PlanSimilarityIndex:
+    """In-memory vector index over the request parameters of cached plans
+    
+    Destinations are compared by character trigram cosine similarity (on the
+    place name alone unless both sides name a region or country) and, when
+    the gazetteer resolves both, by distance. Those only make a plan a draft
+    to adapt: a plan is served as is only for the same destination, i.e. the
+    same normalised name or the same gazetteer place. Travel styles,
+    duration, budget and starting point give a parameter score. At plan cache sizes a
+    vectorized brute-force scan is fast enough; no ANN structure is needed.
+    """
+
+    def __init__(self, entries=()):
+        self.served = 0
+        self.drafted = 0
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._arrays = None
+        for key, params in entries:
+            self.add(key, params)
+
+    @staticmethod
+    def _row(params):
+        destination = str(params.get('destination') or "")
+        parts = [part for part in destination.split(",") if part.strip()]
+        place = forward_geocode(destination)
+        return (
+            _name_vector(parts[0] if parts else destination),
+            _name_vector(destination),
+            len(parts) > 1,
+            zlib.crc32(normalize_place_name(destination).encode()),
+            zlib.crc32(place['location'].encode()) if place else -1,
+            (place['latitude'], place['longitude']) if place else (np.nan, np.nan),
+            _hashed_vector([_normalize_text(style) for style in params.get('travel_style') or []], PLAN_REUSE_STYLE_DIMENSIONS),
+            int(params.get('duration') or 1),
+            zlib.crc32(_normalize_text(params.get('budget')).encode()),
+            zlib.crc32(_normalize_text(params.get('from_location')).encode())
+        )
+
+    def add(self, key, params):
+        row = self._row(params)
+        with self._lock:
+            self._rows[key] = (params, row)
+            self._arrays = None
+
+    def remove(self, key):
+        with self._lock:
+            if self._rows.pop(key, None):
+                self._arrays = None
+
+    def _stacked(self):
+        # Rebuilt lazily after adds and removes; called with the lock held
+        if self._arrays is None:
+            keys = list(self._rows)
+            rows = [self._rows[key][1] for key in keys]
+            columns = list(zip(*rows)) if rows else [()] * 10
+            self._arrays = (keys, *[np.asarray(column) for column in columns])
+        return self._arrays
+
+    def search(self, params):
+        """Return (key, params, destination_similarity, score, exact) for the best candidate, or None"""
+        first, full, qualified, name, place, coords, styles, duration, budget, from_location = self._row(params)
+        with self._lock:
+            keys, firsts, fulls, qualifieds, names, places, coords_all, styles_all, durations, budgets, froms = self._stacked()
+            if not keys:
+                return None
+            
+            # Destination similarity: full names only when both are qualified
+            destination_similarity = np.where(qualifieds & qualified, fulls @ full, firsts @ first)
+            if not np.isnan(coords[0]):
+                lat1, lon1 = np.radians(coords[0]), np.radians(coords[1])
+                lat2, lon2 = np.radians(coords_all[:, 0]), np.radians(coords_all[:, 1])
+                a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+                distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+                known = ~np.isnan(distances)
+                destination_similarity = np.where(known, (distances <= PLAN_REUSE_MAX_KM).astype(float), destination_similarity)
+            
+            style_similarity = styles_all @ styles
+            duration_similarity = np.minimum(durations, duration) / np.maximum(durations, duration)
+            same_budget = budgets == budget
+            same_from = froms == from_location
+            score = 0.4 * style_similarity + 0.3 * duration_similarity + 0.2 * same_budget + 0.1 * same_from
+            score = np.where(destination_similarity >= PLAN_REUSE_DESTINATION_THRESHOLD, score, 0.0)
+            
+            best = int(np.argmax(score))
+            if score[best] < PLAN_REUSE_DRAFT_THRESHOLD:
+                return None
+            # Similar names or nearby places are not the same destination
+            same_destination = names[best] == name or (place != -1 and places[best] == place)
+            exact = bool(same_destination and style_similarity[best] > 0.999 and durations[best] == duration and same_budget[best] and same_from[best])
+            return keys[best], self._rows[keys[best]][0], float(destination_similarity[best]), float(score[best]), exact
+
+    def record(self, exact):
+        """Count a match as served as is or as drafted"""
+        with self._lock:
+            if exact:
+                self.served += 1
+            else:
+                self.drafted += 1
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._rows), 'served': self.served, 'drafted': self.drafted}
+
+@functools.lru_cache(maxsize=None)
+def get_plan_similarity_index():
+    """Process-wide similarity index, seeded from the plan cache"""
+    return PlanSimilarityIndex(get_plan_cache().params())
+
+def find_reusable_plan(destination, duration, budget, travel_style, from_location=None):
+    """Closest cached plan for near-identical inputs as a PlanMatch, or None
+    
+    An exact match names the same destination (equal normalised names, or
+    both resolving to the same gazetteer place, e.g. "Paris" and "Paris,
+    France") with the same trip parameters and can be served as is; any other
+    match is a draft to adapt.
+    """
+    if not PLAN_REUSE_ENABLED:
+        return None
+    index = get_plan_similarity_index()
+    try:
+        found = index.search(_plan_params(destination, duration, budget, travel_style, from_location))
+    except Exception as e:
+        logger.warning("Plan similarity search failed: %s", e)
+        return None
+    if not found:
+        return None
+    key, params, destination_similarity, score, exact = found
+    # Only a plan served as is counts as a cache hit; drafts still run a completion
+    plan_content = get_plan_cache().get(key, count=exact)
+    if not plan_content:
+        # Expired or evicted since it was indexed
+        index.remove(key)
+        return None
+    index.record(exact)
+    return PlanMatch(key, plan_content, params, destination_similarity, score, exact)
+
+def reuse_plan(match, cache_key, params):
+    """Cache a plan served as is under the request's own key, keeping its expiry"""
+    get_plan_cache().copy(match.key, cache_key, params)
+    if PLAN_REUSE_ENABLED:
+        get_plan_similarity_index().add(cache_key, params)
+
+def store_plan(cache_key, plan_content, params, forecast=False):
+    """Cache a generated markdown plan and make it available for reuse
+    
+    Plans written with a weather forecast expire with the forecast.
+    """
+    get_plan_cache().set(cache_key, plan_content, params, WEATHER_CACHE_TTL_SECONDS if forecast else None)
+    if PLAN_REUSE_ENABLED:
+        get_plan_similarity_index().add(cache_key, params)
+
+# Travel planning
+
+def _search_info(context):
+    """Format search results from a destination context for a prompt"""
+    search_info = ""
+    search_results = context.get('search')
+    if search_results and 'organic_results' in search_results:
+        search_info = "\n\nRecent information about this destination:\n"
+        for result in search_results['organic_results'][:3]:
+            search_info += f"- {result.get('title', '')}: {result.get('snippet', '')}\n"
+    return search_info
+
+def _weather_info(context):
+    """Format the daily forecast from a destination context for a prompt"""
+    forecast = context.get('weather')
+    if not forecast or not forecast.get('daily'):
+        return ""
+    weather_info = "\n\nWeather forecast for the coming days (use it if the trip starts soon, e.g. indoor options on rainy days):\n"
+    for day in forecast['daily']:
+        weather_info += f"- {day['date']}: {day['temp_min']:.0f} to {day['temp_max']:.0f}°C, mostly {day['condition'].lower()}, {day['pop']:.0%} chance of rain\n"
+    return weather_info
+
+def _travel_context(from_location):
+    """Describe the traveler's starting point for a prompt"""
+    if from_location and from_location != "Location not detected":
+        return f"\n\nTraveler's Starting Location: {from_location}\nPlease consider transportation logistics and travel time from this starting point."
+    return ""
+
+def build_travel_plan_prompt(destination, duration, budget, travel_style, from_location=None, context=None, coords=None):
+    """Build the travel plan prompt, enriched with whatever search and weather context arrived in time"""
+    if context is None:
+        context = fetch_destination_context(destination, coords)
+    
+    # Get additional destination info if available
+    search_info = _search_info(context)
+    weather_info = _weather_info(context)
+    
+    # Include from location context if available
+    travel_context = _travel_context(from_location)
+    
+    prompt = f"""Create a comprehensive travel plan for {destination} for {duration} days.
+
+Trip Details:
+- Budget Level: {budget}
+- Travel Style: {', '.join(travel_style)}
+- Duration: {duration} days{travel_context}
+
+
+
+{search_info}{weather_info}
+
+Please provide a detailed itinerary including:
+
+1. *Best Time to Visit* 🌞
+   - Optimal seasons and months
+   - Weather considerations
+
+2. *Accommodation Recommendations* 🏨
+   - {budget} budget options with specific names and areas
+   - Booking tips
+
+3. *Day-by-Day Itinerary* 🗺
+   - Daily activities and attractions
+   - Time estimates and logistics
+   - Must-see highlights
+
+4. *Food & Dining* 🍽
+   - Local specialties to try
+   - Restaurant recommendations
+   - Food experiences
+
+5. *Transportation* 🚗
+   - How to get there
+   - Local transportation options
+   - Travel tips
+
+6. *Budget Breakdown* 💰
+   - Estimated costs for accommodation, food, activities
+   - Money-saving tips
+
+7. *Essential Tips* 💡
+   - Cultural considerations
+   - Safety tips
+   - What to pack
+
+Format the response with clear headings and bullet points. Make it practical and actionable."""
+    return prompt
+
+def build_plan_adaptation_prompt(draft, destination, duration, budget, travel_style, from_location=None, context=None):
+    """Build a prompt asking the model to adapt a similar existing plan rather than write one from scratch"""
+    search_info = _search_info(context or {}) + _weather_info(context or {})
+    travel_context = _travel_context(from_location)
+    original = draft.params
+    
+    return f"""Here is an existing travel plan for {original['destination']} ({original['duration']} days, {original['budget']} budget, {', '.join(original['travel_style'])} style):
+
+{draft.plan_content}
+
+Adapt it into a travel plan for {destination} for {duration} days.
+
+Trip Details:
+- Budget Level: {budget}
+- Travel Style: {', '.join(travel_style)}
+- Duration: {duration} days{travel_context}
+{search_info}
+Keep every part that still applies word for word. Only change what the new trip details require: add or remove days, adjust accommodation and costs to the budget level, and rebalance activities for the travel style. Return the complete plan in the same format, without commenting on the changes."""
+
+def _iter_completion_text(stream):
+    """Yield the text deltas from a streaming Groq chat completion"""
+    for chunk in stream:
+        # Groq reports token usage on the final chunk
+        x_groq = getattr(chunk, 'x_groq', None)
+        if x_groq is not None and x_groq.usage is not None:
+            record_llm_usage(x_groq.usage)
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+@traced()
+def generate_travel_plan(destination, duration, budget, travel_style, groq_api_key, from_location=None, force_regenerate=False, context=None, coords=None):
+    """Generate travel plan using Groq API, reusing cached plans for identical inputs"""
+    if not groq_api_key:
+        raise ValueError("Please provide your Groq API key")
+    
+    # Serve identical requests from the plan cache unless a fresh plan was requested
+    plan_cache = get_plan_cache()
+    cache_key = make_plan_cache_key(destination, duration, budget, travel_style, from_location)
+    params = _plan_params(destination, duration, budget, travel_style, from_location)
+    draft = None
+    if not force_regenerate:
+        cached_plan = plan_cache.get(cache_key)
+        if cached_plan:
+            return cached_plan
+        # Near-duplicate requests reuse a similar plan, directly or as a draft
+        draft = find_reusable_plan(destination, duration, budget, travel_style, from_location)
+        if draft and draft.exact:
+            reuse_plan(draft, cache_key, params)
+            return draft.plan_content
+    
+    def complete():
+        client = get_groq_client(groq_api_key)
+        if draft:
+            # The draft may quote its own forecast
+            prompt = build_plan_adaptation_prompt(draft, destination, duration, budget, travel_style, from_location, context)
+            forecast = True
+        else:
+            plan_context = context if context is not None else fetch_destination_context(destination, coords)
+            prompt = build_travel_plan_prompt(destination, duration, budget, travel_style, from_location, plan_context, coords)
+            forecast = bool(_weather_info(plan_context))
+
+        with guarded_call('groq'):
+            response = client.chat.completions.create(
+                messages=[{"role": "user", "content": prompt}],
+                model=PLAN_MODEL,
+                temperature=0.3 if draft else 0.7,
+                max_tokens=2000
+            )
+        
+        record_llm_usage(response.usage)
+        plan_content = response.choices[0].message.content
+        if plan_content:
+            store_plan(cache_key, plan_content, params, forecast)
+        return plan_content
+    
+    # Identical in-flight requests share one completion
+    return get_single_flight().do(f"plan:{cache_key}", complete)
+
+def stream_travel_plan(destination, duration, budget, travel_style, groq_api_key, from_location=None, force_regenerate=False, context=None, coords=None):
+    """Yield travel plan text as it is generated, caching the assembled plan once complete"""
+    if not groq_api_key:
+        raise ValueError("Please provide your Groq API key")
+    
+    plan_cache = get_plan_cache()
+    cache_key = make_plan_cache_key(destination, duration, budget, travel_style, from_location)
+    params = _plan_params(destination, duration, budget, travel_style, from_location)
+    draft = None
+    if not force_regenerate:
+        cached_plan = plan_cache.get(cache_key)
+        if cached_plan:
+            yield cached_plan
+            return
+        draft = find_reusable_plan(destination, duration, budget, travel_style, from_location)
+        if draft and draft.exact:
+            reuse_plan(draft, cache_key, params)
+            yield draft.plan_content
+            return
+    
+    def complete():
+        client = get_groq_client(groq_api_key)
+        if draft:
+            # The draft may quote its own forecast
+            prompt = build_plan_adaptation_prompt(draft, destination, duration, budget, travel_style, from_location, context)
+            forecast = True
+        else:
+            plan_context = context if context is not None else fetch_destination_context(destination, coords)
+            prompt = build_travel_plan_prompt(destination, duration, budget, travel_style, from_location, plan_context, coords)
+            forecast = bool(_weather_info(plan_context))
+
+        chunks = []
+        with guarded_call('groq'):
+            response = client.chat.completions.create(
+                messages=[{"role": "user", "content": prompt}],
+                model=PLAN_MODEL,
+                temperature=0.3 if draft else 0.7,
+                max_tokens=2000,
+                stream=True
+            )
+            for text in _iter_completion_text(response):
+                chunks.append(text)
+                yield text
+        
+        plan_content = "".join(chunks)
+        if plan_content:
+            store_plan(cache_key, plan_content, params, forecast)
+    
+    # Identical in-flight requests subscribe to one shared completion stream
+    yield from get_single_flight().stream(f"plan:{cache_key}", complete)
+
+# Q&A retrieval
+QA_TOP_K = int(os.getenv("QA_TOP_K", "4"))
+QA_CHUNK_WORDS = int(os.getenv("QA_CHUNK_WORDS", "120"))
+QA_HISTORY_TURNS = int(os.getenv("QA_HISTORY_TURNS", "3"))
+QA_HASH_DIMENSIONS = 2 ** 12
+QA_STOPWORDS = frozenset("""
+a an and are as at be by can do for from how i in is it my of on or so that the this to what when where which who why will with you your
+""".split())
+
+def _tokenize(text):
+    """Lowercase word tokens without stopwords"""
+    return [token for token in re.findall(r"[a-z0-9]+", normalize_place_name(text)) if token not in QA_STOPWORDS]
+
+def _split_long_lines(lines, max_words):
+    """Break lines longer than max_words words into pieces on word boundaries"""
+    for line in lines:
+        line_words = line.split()
+        if len(line_words) <= max_words or line.lstrip().startswith("#"):
+            yield line
+            continue
+        for start in range(0, len(line_words), max_words):
+            yield " ".join(line_words[start:start + max_words])
+
+def split_plan_chunks(travel_plan, max_words=QA_CHUNK_WORDS):
+    """Split a markdown plan into heading-scoped chunks of at most max_words words"""
+    chunks = []
+    heading, lines, words = "", [], 0
+    
+    def flush():
+        # Skip heading-only chunks
+        if lines and not (len(lines) == 1 and lines[0].lstrip().startswith("#")):
+            chunks.append("\n".join(([heading] if heading and lines[0] != heading else []) + lines))
+    
+    for line in _split_long_lines(travel_plan.splitlines(), max_words):
+        if not line.strip():
+            continue
+        line_words = len(line.split())
+        if line.lstrip().startswith("#") or words + line_words > max_words:
+            flush()
+            lines, words = [], 0
+            if line.lstrip().startswith("#"):
+                heading = line.strip()
+        lines.append(line)
+        words += line_words
+    flush()
+    return chunks
+
+class PlanIndex:
+    """Hashed TF-IDF index over plan chunks for picking the context relevant to a question"""
+
+    def __init__(self, travel_plan):
+        self.chunks = split_plan_chunks(travel_plan)
+        counts = np.stack([self._counts(chunk) for chunk in self.chunks]) if self.chunks else np.zeros((0, QA_HASH_DIMENSIONS))
+        document_frequency = np.count_nonzero(counts, axis=0)
+        self.idf = np.log((1 + len(self.chunks)) / (1 + document_frequency)) + 1.0
+        self.vectors = self._weight(counts)
+
+    @staticmethod
+    def _counts(text):
+        buckets = [zlib.crc32(token.encode()) % QA_HASH_DIMENSIONS for token in _tokenize(text)]
+        return np.bincount(buckets, minlength=QA_HASH_DIMENSIONS).astype(np.float64)
+
+    def _weight(self, counts):
+        # Sublinear term frequency, IDF weighting, L2 normalisation
+        weighted = np.log1p(counts) * self.idf
+        norms = np.linalg.norm(weighted, axis=-1, keepdims=True)
+        return weighted / np.where(norms == 0, 1.0, norms)
+
+    def search(self, query, k=QA_TOP_K):
+        """Return up to k chunks most similar to the query, in plan order"""
+        if not self.chunks:
+            return []
+        scores = self.vectors @ self._weight(self._counts(query))
+        top = np.argsort(-scores, kind="stable")[:k]
+        top = [int(i) for i in top if scores[i] > 0] or [0]
+        return [self.chunks[i] for i in sorted(top)]
+
+@functools.lru_cache(maxsize=128)
+def get_plan_index(travel_plan):
+    """Index for a plan, built once per distinct plan text"""
+    return PlanIndex(travel_plan)
+
+def build_qa_prompt(question, destination, context_chunks=None):
+    """Build the prompt for a follow-up question about a destination or plan"""
+    context = "\n\n".join(context_chunks or [])
+    return f"""
+                Based on the destination {destination}, answer this question: {question}
+                
+                {"Relevant parts of the travel plan:" + chr(10) + context if context else ""}
+                
+                Provide a helpful, detailed answer about {destination}.
+                """
+
+def answer_question(question, destination, groq_api_key, travel_plan=None, stream=False, history=None):
+    """Answer a travel question; returns the text, or a generator of text chunks when streaming
+    
+    Only the plan chunks most relevant to the question (and the previous
+    question, for follow-ups) are sent. history is a list of
+    {'question', 'answer'} turns, of which the last QA_HISTORY_TURNS are kept.
+    """
+    if not groq_api_key:
+        raise ValueError("Please provide your Groq API key")
+    
+    recent_turns = (history or [])[-QA_HISTORY_TURNS:] if QA_HISTORY_TURNS else []
+    context_chunks = None
+    if travel_plan:
+        query = " ".join([turn['question'] for turn in recent_turns[-1:]] + [question])
+        context_chunks = get_plan_index(travel_plan).search(query)
+    
+    messages = []
+    for turn in recent_turns:
+        messages.append({"role": "user", "content": turn['question']})
+        messages.append({"role": "assistant", "content": turn['answer']})
+    messages.append({"role": "user", "content": build_qa_prompt(question, destination, context_chunks)})
+    
+    client = get_groq_client(groq_api_key)
+    with guarded_call('groq'):
+        response = client.chat.completions.create(
+            messages=messages,
+            model=PLAN_MODEL,
+            temperature=0.7,
+            max_tokens=500,
+            stream=stream
+        )
+    if stream:
+        return _iter_completion_text(response)
+    record_llm_usage(response.usage)
+    return response.choices[0].message.content
+
+# Structured planning
+STRUCTURED_PROMPT_VERSION = "2"
+DAY_CHUNK_SIZE = int(os.getenv("DAY_CHUNK_SIZE", "5"))  # Longer itineraries are generated in parallel chunks
+LLM_MAX_WORKERS = int(os.getenv("LLM_MAX_WORKERS", "4"))  # Concurrent section and day chunk completions per process
+LLM_RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT_SECONDS", "60"))  # Background parts queue for Groq tokens
+GENERIC_ACTIVITY_PREFIXES = ("breakfast", "lunch", "dinner", "check-in", "check-out", "check in", "check out", "free time", "rest")
+
+# Sections in display order, with the trip parameters each one depends on
+PLAN_SECTIONS = [
+    ('best_time', "Best Time to Visit 🌞", "optimal seasons and months, weather considerations", {'destination'}),
+    ('accommodation', "Accommodation Recommendations 🏨", "budget-appropriate options with specific names and areas, booking tips", {'destination', 'budget'}),
+    ('itinerary', "Day-by-Day Itinerary 🗺", "", {'destination', 'budget', 'travel_style'}),
+    ('food', "Food & Dining 🍽", "local specialties, restaurant recommendations, food experiences", {'destination', 'budget', 'travel_style'}),
+    ('transportation', "Transportation 🚗", "how to get there, local transportation options, travel tips", {'destination', 'from_location'}),
+    ('budget', "Budget Breakdown 💰", "estimated costs for accommodation, food, activities; money-saving tips", {'destination', 'budget', 'duration', 'from_location'}),
+    ('tips', "Essential Tips 💡", "cultural considerations, safety tips, what to pack", {'destination', 'travel_style'})
+]
+PLAN_PARAMS = ('destination', 'duration', 'budget', 'travel_style', 'from_location')
+ITINERARY_DEPENDENCIES = next(deps for key, _, _, deps in PLAN_SECTIONS if key == 'itinerary')
+
+@dataclass(slots=True)
+class Activity:
+    time: str
+    title: str
+    description: str = ""
+    estimated_cost: str = ""
+
+@dataclass(slots=True)
+class Day:
+    number: int
+    title: str
+    activities: list = field(default_factory=list)
+
+    def to_markdown(self):
+        lines = [f"### Day {self.number}: {self.title}"]
+        for activity in self.activities:
+            line = f"- **{activity.time} – {activity.title}**"
+            if activity.description:
+                line += f": {activity.description}"
+            if activity.estimated_cost:
+                line += f" _(≈ {activity.estimated_cost})_"
+            lines.append(line)
+        return "\n".join(lines)
+
+@dataclass(slots=True)
+class StructuredPlan:
+    params: dict
+    sections: dict = field(default_factory=dict)
+    days: list = field(default_factory=list)
+
+    def section_markdown(self, key):
+        """Render one section (the itinerary renders its days)"""
+        number, title = next((i + 1, title) for i, (k, title, _, _) in enumerate(PLAN_SECTIONS) if k == key)
+        if key == 'itinerary':
+            body = "\n\n".join(day.to_markdown() for day in self.days)
+        else:
+            body = self.sections.get(key, "")
+        return f"## {number}. {title}\n\n{body}\n\n"
+
+    def to_markdown(self):
+        return "".join(self.section_markdown(key) for key, _, _, _ in PLAN_SECTIONS)
+
+    def to_json(self):
+        return json.dumps({
+            'params': self.params,
+            'sections': self.sections,
+            'days': [
+                {'number': day.number, 'title': day.title, 'activities': [
+                    {'time': a.time, 'title': a.title, 'description': a.description, 'estimated_cost': a.estimated_cost}
+                    for a in day.activities
+                ]}
+                for day in self.days
+            ]
+        })
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        days = [
+            Day(day['number'], day['title'], [Activity(**activity) for activity in day['activities']])
+            for day in data['days']
+        ]
+        return cls(data['params'], data['sections'], days)
+
+def _parse_json_object(text):
+    """Parse a JSON object from a completion, tolerating surrounding prose"""
+    try:
+        return json.loads(text)
+    except ValueError:
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end <= start:
+            raise
+        return json.loads(text[start:end + 1])
+
+def _parse_days(data):
+    """Build Day objects from a {"days": [...]} completion"""
+    days = []
+    for item in data.get('days', []):
+        activities = [
+            Activity(
+                str(activity.get('time', '')),
+                str(activity.get('title', '')),
+                str(activity.get('description', '')),
+                str(activity.get('estimated_cost', ''))
+            )
+            for activity in item.get('activities', [])
+        ]
+        days.append(Day(int(item.get('day', len(days) + 1)), str(item.get('title', '')), activities))
+    return days
+
+def changed_plan_params(previous_params, params):
+    """Names of trip parameters that differ between two plans"""
+    def normalized(name, value):
+        if name == 'travel_style':
+            return sorted(_normalize_text(style) for style in (value or []))
+        if name == 'duration':
+            return int(value)
+        return _normalize_text(value)
+    return {
+        name for name in PLAN_PARAMS
+        if normalized(name, previous_params.get(name)) != normalized(name, params.get(name))
+    }
+
+def _structured_trip_details(params, context):
+    return f"""Trip Details:
+- Destination: {params['destination']}
+- Budget Level: {params['budget']}
+- Travel Style: {', '.join(params['travel_style'])}
+- Duration: {params['duration']} days{_travel_context(params['from_location'])}
+{_search_info(context)}{_weather_info(context)}"""
+
+def _complete_json(groq_api_key, prompt, max_tokens):
+    """Run a JSON-mode Groq completion and parse the object it returns"""
+    client = get_groq_client(groq_api_key)
+    # Structured plans run as background jobs, so wait for a rate limit token rather than fail
+    with guarded_call('groq', LLM_RATE_LIMIT_MAX_WAIT_SECONDS):
+        response = client.chat.completions.create(
+            messages=[{"role": "user", "content": prompt}],
+            model=PLAN_MODEL,
+            temperature=0.7,
+            max_tokens=max_tokens,
+            response_format={"type": "json_object"}
+        )
+    record_llm_usage(response.usage)
+    return _parse_json_object(response.choices[0].message.content)
+
+def _skeleton_details(skeleton, day_numbers=None):
+    """Describe the shared trip skeleton so separately generated parts agree"""
+    if not skeleton:
+        return ""
+    themes = "\n".join(f"- Day {n}: {theme}" for n, theme in sorted(skeleton['day_themes'].items()))
+    details = f"\nShared trip skeleton (stay consistent with it):\n{skeleton['base']}\nDay themes:\n{themes}\n"
+    if day_numbers:
+        details += "Do not repeat sights assigned to other days.\n"
+    return details
+
+def generate_plan_skeleton(params, day_numbers, groq_api_key, context):
+    """Plan lodging, transport, budget and a theme per day, shared by all day chunks"""
+    prompt = f"""You are planning a {params['duration']}-day trip to {params['destination']}.
+
+{_structured_trip_details(params, context)}
+
+Before the detailed itinerary is written in parallel parts, fix the shared skeleton.
+Return a JSON object {{"base": "<3 sentences: where to stay, how to get around, daily budget>", "day_themes": {{"<day number>": "<area or theme and its key sights>"}}}}
+covering days {', '.join(str(n) for n in day_numbers)}. Spread the must-see highlights so no sight repeats."""
+    data = _complete_json(groq_api_key, prompt, 150 + 40 * len(day_numbers))
+    day_themes = {
+        int(day): str(theme) for day, theme in data.get('day_themes', {}).items()
+        if str(day).strip().isdigit()
+    }
+    return {'base': str(data.get('base', '')), 'day_themes': day_themes}
+
+def merge_day_chunks(chunks, day_numbers, earlier_days=()):
+    """Consistency pass over separately generated days
+    
+    Keeps one Day per wanted number in order and drops sights already visited
+    on an earlier day. Returns the merged days and any day numbers missing.
+    """
+    wanted = set(day_numbers)
+    by_number = {}
+    for chunk in chunks:
+        for day in chunk:
+            if day.number in wanted and day.number not in by_number:
+                by_number[day.number] = day
+    
+    seen = {_normalize_text(activity.title) for day in earlier_days for activity in day.activities}
+    merged = []
+    for number in sorted(by_number):
+        day = by_number[number]
+        activities = []
+        for activity in day.activities:
+            title = _normalize_text(activity.title)
+            if title in seen and not title.startswith(GENERIC_ACTIVITY_PREFIXES):
+                continue
+            seen.add(title)
+            activities.append(activity)
+        day.activities = activities or day.activities
+        merged.append(day)
+    return merged, [n for n in day_numbers if n not in by_number]
+
+def generate_plan_sections(params, section_keys, groq_api_key, context, skeleton=None):
+    """Generate the given non-itinerary sections as markdown, keyed by section"""
+    wanted = [(key, title, hint) for key, title, hint, _ in PLAN_SECTIONS if key in section_keys]
+    section_list = "\n".join(f'- "{key}": {title} ({hint})' for key, title, hint in wanted)
+    prompt = f"""You are planning a trip to {params['destination']}.
+
+{_structured_trip_details(params, context)}{_skeleton_details(skeleton)}
+
+Return a JSON object {{"sections": {{...}}}} with exactly these keys, each mapped to concise markdown bullet points:
+{section_list}"""
+    data = _complete_json(groq_api_key, prompt, 300 * len(wanted))
+    sections = data.get('sections', data)
+    return {key: str(sections.get(key, "")) for key, _, _ in wanted}
+
+def generate_plan_days(params, day_numbers, groq_api_key, context, skeleton=None):
+    """Generate itinerary days for the given day numbers"""
+    prompt = f"""You are planning a {params['duration']}-day trip to {params['destination']}.
+
+{_structured_trip_details(params, context)}{_skeleton_details(skeleton, day_numbers)}
+
+Write the itinerary for days {', '.join(str(n) for n in day_numbers)} only.
+Return a JSON object {{"days": [{{"day": <number>, "title": "<theme>", "activities": [{{"time": "09:00", "title": "...", "description": "...", "estimated_cost": "..."}}]}}]}}
+with 3-5 activities per day, including time estimates, logistics and must-see highlights."""
+    days = _parse_days(_complete_json(groq_api_key, prompt, 250 * len(day_numbers)))
+    wanted = set(day_numbers)
+    return [day for day in days if day.number in wanted]
+
+def _day_chunk_result(future):
+    """Days from a chunk, or none if it failed so the catch-up call regenerates them"""
+    try:
+        return future.result()
+    except Exception as e:
+        logger.warning("Day chunk failed, regenerating its days: %s", e)
+        return []
+
+def stream_structured_plan(destination, duration, budget, travel_style, groq_api_key, from_location=None, force_regenerate=False, previous=None, coords=None):
+    """Generate a StructuredPlan, regenerating only what changed since previous
+    
+    Yields the plan's markdown section by section as parts complete and
+    returns the StructuredPlan as the generator's return value.
+    """
+    if not groq_api_key:
+        raise ValueError("Please provide your Groq API key")
+    
+    params = {
+        'destination': destination,
+        'duration': int(duration),
+        'budget': budget,
+        'travel_style': list(travel_style or []),
+        'from_location': from_location
+    }
+    plan_cache = get_plan_cache()
+    cache_key = make_plan_cache_key(destination, duration, budget, travel_style, from_location, variant=f"structured-{STRUCTURED_PROMPT_VERSION}")
+    if not force_regenerate:
+        cached_plan = plan_cache.get(cache_key)
+        if cached_plan:
+            plan = StructuredPlan.from_json(cached_plan)
+            yield plan.to_markdown()
+            return plan
+    
+    # Work out which sections and days the parameter change invalidates
+    if previous is None or force_regenerate:
+        changed = set(PLAN_PARAMS)
+    else:
+        changed = changed_plan_params(previous.params, params)
+    section_keys = [key for key, _, _, deps in PLAN_SECTIONS if key != 'itinerary' and deps & changed]
+    if previous is None or changed & ITINERARY_DEPENDENCIES:
+        kept_days = []
+    else:
+        kept_days = [day for day in previous.days if day.number <= params['duration']]
+    # Any day not kept, including gaps an earlier failed catch-up left behind
+    kept = {day.number for day in kept_days}
+    day_numbers = [n for n in range(1, params['duration'] + 1) if n not in kept]
+    
+    context = fetch_destination_context(destination, coords) if section_keys or day_numbers else {}
+    
+    # Long itineraries: fix a shared skeleton first, then write day chunks in parallel
+    skeleton = None
+    day_chunks = [day_numbers[i:i + DAY_CHUNK_SIZE] for i in range(0, len(day_numbers), DAY_CHUNK_SIZE)]
+    if len(day_chunks) > 1:
+        skeleton = generate_plan_skeleton(params, day_numbers, groq_api_key, context)
+    
+    executor = get_llm_executor()
+    sections_future = executor.submit(generate_plan_sections, params, section_keys, groq_api_key, context, skeleton) if section_keys else None
+    day_futures = [executor.submit(generate_plan_days, params, chunk, groq_api_key, context, skeleton) for chunk in day_chunks]
+    
+    plan = StructuredPlan(params, dict(previous.sections) if previous else {}, list(kept_days))
+    for key, _, _, _ in PLAN_SECTIONS:
+        # Render in display order, waiting only for the part that is still generating
+        if key == 'itinerary' and day_futures:
+            new_days, missing = merge_day_chunks([_day_chunk_result(future) for future in day_futures], day_numbers, kept_days)
+            if missing:
+                # One catch-up call for days a chunk dropped
+                extra_days = generate_plan_days(params, missing, groq_api_key, context, skeleton)
+                new_days, _ = merge_day_chunks([new_days, extra_days], day_numbers, kept_days)
+            plan.days = sorted(kept_days + new_days, key=lambda day: day.number)
+        elif key in section_keys:
+            plan.sections.update(sections_future.result())
+        yield plan.section_markdown(key)
+    
+    # Sections and days kept from the previous plan may quote its forecast
+    forecast = bool(_weather_info(context)) or previous is not None
+    plan_cache.set(cache_key, plan.to_json(), ttl_seconds=WEATHER_CACHE_TTL_SECONDS if forecast else None)
+    return plan
+
+# Background plan generation
+PLAN_MAX_WORKERS = int(os.getenv("PLAN_MAX_WORKERS", "4"))  # Max concurrent Groq plan completions per process
+PLAN_MAX_PENDING_JOBS = int(os.getenv("PLAN_MAX_PENDING_JOBS", "32"))
+PLAN_JOB_TTL_SECONDS = int(os.getenv("PLAN_JOB_TTL_SECONDS", "3600"))
+
+class PlanQueueFull(RuntimeError):
+    """Raised when the plan job queue is at capacity"""
+
+class PlanJob:
+    """A plan generation running in the background, with partial output"""
+
+    def __init__(self, job_id, params, stream_func):
+        self.id = job_id
+        self.params = params
+        self.stream_func = stream_func
+        self.status = 'queued'  # queued -> running -> done | failed | cancelled
+        self.chunks = []
+        self.result = None
+        self.value = None  # Return value of the stream generator, e.g. a StructuredPlan
+        self.error = None
+        self.created_at = time.time()
+        self.first_chunk_at = None
+        self.finished_at = None
+        self.future = None
+        self._cancelled = threading.Event()
+
+    @property
+    def partial_text(self):
+        return "".join(self.chunks)
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Cancel a queued job immediately, or stop a running one at its next chunk"""
+        self._cancelled.set()
+        if self.future and self.future.cancel():
+            self.status = 'cancelled'
+            self.finished_at = time.time()
+
+class PlanJobQueue:
+    """Bounded worker pool that runs plan generation jobs independently of callers"""
+
+    def __init__(self, max_workers, max_pending, ttl_seconds):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="plan-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, stream_func=None, **params):
+        """Queue a job running stream_func(**params) (default stream_travel_plan) and return it"""
+        with self._lock:
+            self._prune()
+            active = sum(1 for job in self._jobs.values() if not job.finished)
+            if active >= self.max_workers + self.max_pending:
+                raise PlanQueueFull("The planner is busy, please try again in a moment")
+            job = PlanJob(uuid.uuid4().hex, params, stream_func or stream_travel_plan)
+            self._jobs[job.id] = job
+            job.future = self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        """Return a job by ID, or None once it has expired"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        """Return job counts by status"""
+        with self._lock:
+            counts = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0, 'cancelled': 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return counts
+
+    def _prune(self):
+        # Forget finished jobs nobody collected within the TTL
+        cutoff = time.time() - self.ttl_seconds
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def _run(self, job):
+        if job.cancelled:
+            job.status = 'cancelled'
+            job.finished_at = time.time()
+            return
+        
+        job.status = 'running'
+        
+        def relay():
+            job.value = yield from job.stream_func(**job.params)
+        
+        stream = relay()
+        try:
+            for text in stream:
+                if job.cancelled:
+                    # Closing the generator drops the Groq stream
+                    stream.close()
+                    job.status = 'cancelled'
+                    return
+                if job.first_chunk_at is None:
+                    job.first_chunk_at = time.time()
+                job.chunks.append(text)
+            job.result = job.partial_text
+            job.status = 'done'
+        except Exception as e:
+            logger.warning("Plan job %s failed: %s", job.id, e)
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+
+@functools.lru_cache(maxsize=None)
+def get_plan_job_queue():
+    """Process-wide plan job queue with a global concurrency limit"""
+    return PlanJobQueue(PLAN_MAX_WORKERS, PLAN_MAX_PENDING_JOBS, PLAN_JOB_TTL_SECONDS)
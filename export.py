@@ -0,0 +1,318 @@
+"""SmartTrip AI plan export: markdown travel plans as PDF, HTML or plain text
+
+A plan is parsed once into blocks (headings, list items, paragraphs) with
+inline bold/italic spans, and each format renders those blocks. Rendered
+files are memoized per plan, destination and format, so repeated downloads
+reuse the same bytes. PDF output needs fpdf2; without it only HTML and text
+are offered; it is imported on the first PDF export.
+"""
+import os
+import re
+import html
+import datetime
+import functools
+import importlib.util
+import textwrap
+import unicodedata
+
+# Export configuration
+EXPORT_CACHE_SIZE = int(os.getenv("EXPORT_CACHE_SIZE", "64"))
+EXPORT_PDF_FONT = os.getenv("EXPORT_PDF_FONT", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")
+EXPORT_PDF_BOLD_FONT = os.getenv("EXPORT_PDF_BOLD_FONT", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf")
+EXPORT_FORMATS = {
+    'pdf': ('application/pdf', 'pdf'),
+    'html': ('text/html', 'html'),
+    'text': ('text/plain', 'txt')
+}
+
+HEADING_COLORS = {1: (0, 168, 232), 2: (255, 107, 107), 3: (78, 205, 196)}
+
+# Markdown parsing
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*?)\s*#*$")
+BULLET_PATTERN = re.compile(r"^(\s*)[-*+•]\s+(.*)$")
+NUMBERED_PATTERN = re.compile(r"^(\s*)(\d+)[.)]\s+(.*)$")
+RULE_PATTERN = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+INLINE_PATTERN = re.compile(r"\*\*(.+?)\*\*|__(.+?)__|\*(?!\s)(.+?)\*|(?<!\w)_(?!\s)(.+?)(?<!\s)_(?!\w)|`(.+?)`")
+
+def parse_inline(text):
+    """Split a line into (text, bold, italic) spans in a single scan"""
+    spans = []
+    position = 0
+    for match in INLINE_PATTERN.finditer(text):
+        if match.start() > position:
+            spans.append((text[position:match.start()], False, False))
+        bold, underscore_bold, italic, underscore_italic, code = match.groups()
+        if bold or underscore_bold:
+            spans.append((bold or underscore_bold, True, False))
+        elif italic or underscore_italic:
+            spans.append((italic or underscore_italic, False, True))
+        else:
+            spans.append((code, False, False))
+        position = match.end()
+    if position < len(text):
+        spans.append((text[position:], False, False))
+    return spans
+
+def parse_markdown(text):
+    """Parse markdown into (kind, level, spans) blocks
+
+    kind is 'heading' (level 1-6), 'bullet' or 'numbered' (level is the
+    nesting depth; numbered items keep their number as the first span),
+    'paragraph' or 'rule'. Consecutive plain lines form one paragraph.
+    """
+    blocks = []
+    paragraph = []
+
+    def flush():
+        if paragraph:
+            blocks.append(('paragraph', 0, parse_inline(" ".join(paragraph))))
+            paragraph.clear()
+
+    for line in text.splitlines():
+        if not line.strip():
+            flush()
+            continue
+        if RULE_PATTERN.match(line):
+            flush()
+            blocks.append(('rule', 0, []))
+            continue
+        match = HEADING_PATTERN.match(line)
+        if match:
+            flush()
+            blocks.append(('heading', len(match.group(1)), parse_inline(match.group(2))))
+            continue
+        match = NUMBERED_PATTERN.match(line)
+        if match:
+            flush()
+            level = len(match.group(1).expandtabs(4)) // 2
+            blocks.append(('numbered', level, [(match.group(2), False, False)] + parse_inline(match.group(3))))
+            continue
+        match = BULLET_PATTERN.match(line)
+        if match:
+            flush()
+            level = len(match.group(1).expandtabs(4)) // 2
+            blocks.append(('bullet', level, parse_inline(match.group(2))))
+            continue
+        paragraph.append(line.strip())
+    flush()
+    return blocks
+
+@functools.lru_cache(maxsize=EXPORT_CACHE_SIZE)
+def _plan_blocks(travel_plan):
+    return tuple(parse_markdown(travel_plan))
+
+def _plain(spans):
+    return "".join(text for text, _, _ in spans)
+
+# Renderers
+
+HTML_STYLE = """
+        body { font-family: Arial, sans-serif; margin: 20px; color: #333; line-height: 1.6; }
+        h1 { color: #00A8E8; text-align: center; border-bottom: 3px solid #00A8E8; padding-bottom: 10px; }
+        h2 { color: #FF6B6B; border-bottom: 2px solid #FF6B6B; padding-bottom: 5px; }
+        h3 { color: #4ECDC4; }
+        p, li { line-height: 1.6; }
+        .header { text-align: center; margin-bottom: 30px; }
+        .content { max-width: 800px; margin: 0 auto; }
+        .date { text-align: right; color: #666; font-size: 0.9em; }
+"""
+
+def _html_inline(spans):
+    parts = []
+    for text, bold, italic in spans:
+        text = html.escape(text)
+        if bold:
+            text = f"<strong>{text}</strong>"
+        elif italic:
+            text = f"<em>{text}</em>"
+        parts.append(text)
+    return "".join(parts)
+
+def render_html(blocks, destination, generated_on):
+    """Render blocks as a standalone HTML document"""
+    body = []
+    lists = []  # Open list tags, one per nesting level
+
+    def close_lists(depth=0):
+        while len(lists) > depth:
+            body.append(f"</li></{lists.pop()}>")
+
+    for kind, level, spans in blocks:
+        if kind not in ('bullet', 'numbered'):
+            close_lists()
+            if kind == 'heading':
+                # Plan headings sit below the document's own h1/h2
+                tag = f"h{min(level + 1, 6)}"
+                body.append(f"<{tag}>{_html_inline(spans)}</{tag}>")
+            elif kind == 'rule':
+                body.append("<hr>")
+            else:
+                body.append(f"<p>{_html_inline(spans)}</p>")
+            continue
+
+        tag = 'ol' if kind == 'numbered' else 'ul'
+        level = min(level, len(lists))
+        close_lists(level + 1)
+        if len(lists) == level + 1 and lists[-1] != tag:
+            close_lists(level)
+        if len(lists) == level + 1:
+            body.append("</li>")
+        else:
+            body.append(f"<{tag}>")
+            lists.append(tag)
+        if kind == 'numbered':
+            body.append(f'<li value="{html.escape(spans[0][0])}">{_html_inline(spans[1:])}')
+        else:
+            body.append(f"<li>{_html_inline(spans)}")
+    close_lists()
+
+    destination = html.escape(destination)
+    content = "\n".join(body)
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <title>Travel Plan - {destination}</title>
+    <style>{HTML_STYLE}    </style>
+</head>
+<body>
+    <div class="header">
+        <h1>🌎 AI Travel Plan</h1>
+        <h2>Destination: {destination}</h2>
+        <div class="date">Generated on: {generated_on}</div>
+    </div>
+    <div class="content">
+{content}
+    </div>
+</body>
+</html>
+""".encode("utf-8")
+
+def render_text(blocks, destination, generated_on, width=80):
+    """Render blocks as wrapped plain text"""
+    lines = [f"AI Travel Plan - {destination}", f"Generated on: {generated_on}", ""]
+    for kind, level, spans in blocks:
+        if kind == 'heading':
+            text = _plain(spans)
+            if lines[-1]:
+                lines.append("")
+            lines.extend([text, ("=" if level == 1 else "-") * len(text)])
+        elif kind == 'rule':
+            lines.append("-" * width)
+        elif kind in ('bullet', 'numbered'):
+            indent = "  " * level
+            marker = f"{spans[0][0]}. " if kind == 'numbered' else "- "
+            text = _plain(spans[1:] if kind == 'numbered' else spans)
+            lines.extend(textwrap.wrap(text, width, initial_indent=indent + marker,
+                                       subsequent_indent=indent + " " * len(marker)) or [indent + marker])
+        else:
+            lines.extend(textwrap.wrap(_plain(spans), width) + [""])
+    return ("\n".join(lines).strip() + "\n").encode("utf-8")
+
+def _pdf_safe(text, unicode_font):
+    """Drop emoji (no glyphs in the PDF fonts); core fonts also need latin-1"""
+    text = "".join(ch for ch in text if unicodedata.category(ch) not in ('So', 'Cs', 'Cf', 'Mn') or ch == "•")
+    if unicode_font:
+        return text
+    text = unicodedata.normalize("NFKD", text.replace("•", "-"))
+    return text.encode("latin-1", "replace").decode("latin-1")
+
+def render_pdf(blocks, destination, generated_on):
+    """Render blocks as PDF bytes with fpdf2"""
+    if not pdf_available():
+        raise RuntimeError("PDF export requires the fpdf2 package")
+    from fpdf import FPDF
+    pdf = FPDF(format="A4")
+    pdf.set_margins(18, 18, 18)
+    pdf.set_auto_page_break(True, margin=18)
+
+    unicode_font = os.path.exists(EXPORT_PDF_FONT) and os.path.exists(EXPORT_PDF_BOLD_FONT)
+    if unicode_font:
+        # No oblique face is bundled: italics fall back to the upright fonts
+        for style, path in (("", EXPORT_PDF_FONT), ("B", EXPORT_PDF_BOLD_FONT),
+                            ("I", EXPORT_PDF_FONT), ("BI", EXPORT_PDF_BOLD_FONT)):
+            pdf.add_font("PlanSans", style, path)
+        family = "PlanSans"
+    else:
+        family = "Helvetica"
+    pdf.add_page()
+
+    def write_spans(spans, indent=0):
+        # Styled spans are written one by one rather than through fpdf2's
+        # markdown mode, which would eat "--", "~~" or "[..](..)" in the text
+        left_margin = pdf.l_margin
+        pdf.set_left_margin(left_margin + indent)
+        pdf.set_x(left_margin + indent)
+        for text, bold, italic in spans:
+            pdf.set_font(family, ("B" if bold else "") + ("I" if italic else ""), 10.5)
+            pdf.write(5.5, _pdf_safe(text, unicode_font))
+        pdf.ln(5.5)
+        pdf.set_left_margin(left_margin)
+
+    # Document header
+    pdf.set_font(family, "B", 20)
+    pdf.set_text_color(*HEADING_COLORS[1])
+    pdf.cell(0, 12, "AI Travel Plan", align="C", new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font(family, "B", 14)
+    pdf.set_text_color(*HEADING_COLORS[2])
+    pdf.multi_cell(0, 8, _pdf_safe(f"Destination: {destination}", unicode_font), align="C", new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font(family, "", 9)
+    pdf.set_text_color(102, 102, 102)
+    pdf.cell(0, 6, f"Generated on: {generated_on}", align="R", new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(4)
+
+    for kind, level, spans in blocks:
+        pdf.set_text_color(51, 51, 51)
+        if kind == 'heading':
+            size = {1: 16, 2: 14, 3: 12}.get(level, 11)
+            pdf.ln(3)
+            pdf.set_font(family, "B", size)
+            pdf.set_text_color(*HEADING_COLORS.get(level, (51, 51, 51)))
+            pdf.multi_cell(0, size * 0.5, _pdf_safe(_plain(spans), unicode_font), new_x="LMARGIN", new_y="NEXT")
+            pdf.ln(1)
+        elif kind == 'rule':
+            pdf.set_draw_color(200, 200, 200)
+            pdf.line(pdf.l_margin, pdf.get_y() + 2, pdf.w - pdf.r_margin, pdf.get_y() + 2)
+            pdf.ln(5)
+        elif kind in ('bullet', 'numbered'):
+            pdf.set_font(family, "", 10.5)
+            indent = 5 * (level + 1)
+            if kind == 'numbered':
+                marker, spans = f"{spans[0][0]}.", spans[1:]
+            else:
+                marker = "•" if unicode_font else "-"
+            pdf.set_x(pdf.l_margin + indent - 4)
+            pdf.cell(4, 5.5, marker)
+            write_spans(spans, indent)
+        else:
+            write_spans(spans)
+            pdf.ln(2)
+    return bytes(pdf.output())
+
+RENDERERS = {'pdf': render_pdf, 'html': render_html, 'text': render_text}
+
+@functools.lru_cache(maxsize=None)
+def pdf_available():
+    """Whether fpdf2 is installed, checked without importing it"""
+    return importlib.util.find_spec("fpdf") is not None
+
+def available_formats():
+    """Export formats usable in this environment"""
+    return [fmt for fmt in EXPORT_FORMATS if fmt != 'pdf' or pdf_available()]
+
+def export_file_name(destination, fmt):
+    """Download file name for a plan export"""
+    ascii_name = unicodedata.normalize("NFKD", destination or "").encode("ascii", "ignore").decode()
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", ascii_name).strip("_") or "trip"
+    return f"travel_plan_{slug}.{EXPORT_FORMATS[fmt][1]}"
+
+@functools.lru_cache(maxsize=EXPORT_CACHE_SIZE)
+def _export(travel_plan, destination, fmt, generated_on):
+    return RENDERERS[fmt](_plan_blocks(travel_plan), destination, generated_on)
+
+def export_plan(travel_plan, destination, fmt="pdf"):
+    """Render a plan as 'pdf', 'html' or 'text' bytes, memoized per plan, destination, format and day"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    return _export(travel_plan, destination or "", fmt, datetime.date.today().strftime('%B %d, %Y'))
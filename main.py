@@ -1,24 +1,65 @@
+import time
+# Taken first so the cold-start timing includes the imports below
+run_started = time.perf_counter()
+
 import streamlit as st
 import os
-import folium
-from streamlit_folium import st_folium
-from geopy.geocoders import Nominatim
-import requests
-import pyttsx3
-import threading
-import tempfile
-from groq import Groq
 from dotenv import load_dotenv
 import json
 import base64
 from io import BytesIO
 import datetime
-import hashlib
-import random
+import html
+import functools
+import uuid
+import ipaddress
+imports_started = time.perf_counter()
+from export import EXPORT_FORMATS, available_formats, export_file_name, export_plan, parse_markdown
+from engine import (
+    get_plan_cache,
+    get_saved_plan_store,
+    get_weather_cache,
+    get_plan_similarity_index,
+    get_gazetteer,
+    get_weather_data,
+    get_location_images,
+    get_thumbnail,
+    get_speech,
+    speech_pending,
+    THUMBNAIL_SIZE,
+    reverse_geocode,
+    suggest_destinations,
+    forward_geocode,
+    get_user_location_from_ip,
+    fetch_concurrently,
+    answer_question,
+    stream_structured_plan,
+    DAY_CHUNK_SIZE,
+    get_plan_job_queue,
+    get_run_timings,
+    span,
+    start_run_trace,
+    finish_run_trace,
+    start_metrics_server,
+    PlanQueueFull
+)
+imports_finished = time.perf_counter()
+run_trace = start_run_trace("main", started=run_started)
+run_trace.add("imports", imports_started, imports_finished - imports_started)
+start_metrics_server()
 
 # Load environment variables
 load_dotenv()
 
+# Static assets (CSS and fixed HTML) are read once per process
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+@functools.lru_cache(maxsize=None)
+def load_static_asset(name):
+    """Contents of a file in static/"""
+    with open(os.path.join(STATIC_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
 # Page configuration
 st.set_page_config(
     page_title="TRIP GENIE",
@@ -27,106 +68,11 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Enhanced Vibrant CSS
-st.markdown("""
-<style>
-/* ===== COLOR SYSTEM ===== */
-:root {
-    --primary: #2563EB;        /* Blue */
-    --secondary: #9333EA;      /* Purple */
-    --accent: #F97316;         /* Orange */
-    --success: #22C55E;        /* Green */
-    --bg-main: linear-gradient(135deg, #EFF6FF, #FFFFFF);
-    --card-bg: #FFFFFF;
-    --text-dark: #0F172A;
-    --text-muted: #475569;
-    --sidebar-bg: #0F172A;
-    --sidebar-text: #E5E7EB;
-    --border-radius: 14px;
-    --shadow: 0 10px 25px rgba(0,0,0,0.08);
-}
-
-/* ===== APP BACKGROUND ===== */
-html, body, .stApp {
-    background: var(--bg-main) !important;
-    color: var(--text-dark) !important;
-    font-family: "Segoe UI", Roboto, sans-serif;
-}
-
-/* ===== HEADINGS ===== */
-h1, h2, h3, h4 {
-    color: var(--primary) !important;
-    font-weight: 700;
-}
-
-p, li, span {
-    color: var(--text-dark) !important;
-    font-size: 16px;
-}
-
-/* ===== CARDS ===== */
-.feature-card,
-.travel-summary,
-.weather-card {
-    background: var(--card-bg) !important;
-    border-radius: var(--border-radius);
-    padding: 18px;
-    box-shadow: var(--shadow);
-    margin-bottom: 15px;
-}
-
-/* ===== SIDEBAR ===== */
-section[data-testid="stSidebar"] {
-    background: var(--sidebar-bg) !important;
-}
+# Enhanced Vibrant CSS (static/style.css)
+st.markdown(f"<style>{load_static_asset('style.css')}</style>", unsafe_allow_html=True)
 
-section[data-testid="stSidebar"] * {
-    color: var(--sidebar-text) !important;
-}
-
-section[data-testid="stSidebar"] h1,
-section[data-testid="stSidebar"] h2,
-section[data-testid="stSidebar"] h3 {
-    color: #FFFFFF !important;
-}
-
-/* ===== INPUT FIELDS ===== */
-input, textarea {
-    background-color: #1E293B !important;
-    color: #F8FAFC !important;
-    border-radius: 10px !important;
-    border: 1px solid #475569 !important;
-}
-
-/* ===== BUTTONS ===== */
-.stButton button {
-    background: linear-gradient(135deg, var(--primary), var(--secondary)) !important;
-    color: white !important;
-    font-weight: 700;
-    border-radius: 12px;
-    padding: 0.6rem 1.2rem;
-    box-shadow: var(--shadow);
-    transition: transform 0.2s ease, box-shadow 0.2s ease;
-}
-
-.stButton button:hover {
-    transform: translateY(-2px);
-    box-shadow: 0 15px 30px rgba(0,0,0,0.15);
-    background: linear-gradient(135deg, var(--secondary), var(--primary)) !important;
-}
-
-/* ===== MAP & IMAGES ===== */
-.image-item img {
-    border-radius: 14px;
-    box-shadow: var(--shadow);
-}
-
-/* ===== FOOTER TEXT ===== */
-footer, .css-164nlkn {
-    color: var(--text-muted) !important;
-}
-</style>
-""", unsafe_allow_html=True)
+USER_ID_COOKIE = "travel_planner_uid"
+USER_ID_COOKIE_MAX_AGE = 365 * 24 * 3600
 
 # Initialize session state
 if 'travel_plan' not in st.session_state:
@@ -141,13 +87,44 @@ if 'location_images' not in st.session_state:
     st.session_state.location_images = []
 if 'tts_played' not in st.session_state:
     st.session_state.tts_played = False
+if 'plan_audio' not in st.session_state:
+    # (summary text, WAV path or None) once synthesis finished
+    st.session_state.plan_audio = None
+    st.session_state.plan_audio_pending = None
+    st.session_state.plan_audio_autoplay = False
 if 'user_session_id' not in st.session_state:
-    # Create a unique session ID for the user
-    st.session_state.user_session_id = hashlib.md5(str(datetime.datetime.now()).encode()).hexdigest()[:16]
-if 'saved_plans' not in st.session_state:
-    st.session_state.saved_plans = []
+    # Keep the user ID in a cookie rather than the URL: saved plans survive
+    # reloads and restarts, but a shared link does not expose them
+    try:
+        user_id = st.context.cookies.get(USER_ID_COOKIE)
+    except Exception:
+        user_id = None
+    if not (isinstance(user_id, str) and user_id.isalnum()):
+        user_id = uuid.uuid4().hex[:16]
+    st.session_state.user_session_id = user_id
+    if 'uid' in st.query_params:
+        del st.query_params['uid']
+if 'saved_plans_page' not in st.session_state:
+    st.session_state.saved_plans_page = 0
 if 'user_preferences' not in st.session_state:
     st.session_state.user_preferences = {}
+if 'plan_job_id' not in st.session_state:
+    st.session_state.plan_job_id = None
+if 'structured_plan' not in st.session_state:
+    st.session_state.structured_plan = None
+if 'qa_history' not in st.session_state:
+    st.session_state.qa_history = []
+
+try:
+    user_cookie = st.context.cookies.get(USER_ID_COOKIE)
+except Exception:
+    user_cookie = None
+if user_cookie != st.session_state.user_session_id:
+    # Cookies are only read when the session connects, so set it from the browser
+    st.iframe(
+        f"<script>document.cookie = '{USER_ID_COOKIE}={st.session_state.user_session_id}; "
+        f"Max-Age={USER_ID_COOKIE_MAX_AGE}; Path=/; SameSite=Lax';</script>"
+    )
 
 # API Configuration
 GROQ_API_KEY = os.getenv("GROQ_API_KEY", "")
@@ -155,158 +132,60 @@ SERP_API_KEY = os.getenv("SERP_API_KEY", "")
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY", "")
 UNSPLASH_ACCESS_KEY = os.getenv("UNSPLASH_ACCESS_KEY", "")
 
-def play_welcome_message():
-    """Play welcome message using text-to-speech"""
-    try:
-        if not st.session_state.tts_played:
-            def speak():
-                engine = pyttsx3.init() 
-                engine.setProperty('rate', 150)
-                engine.setProperty('volume', 0.8)
-                voices = engine.getProperty('voices')
-                if voices:
-                    engine.setProperty('voice', voices[0].id)
-                engine.say("Welcome to your AI Travel Planner! Let's plan your perfect adventure!")
-                engine.runAndWait()
-            
-            thread = threading.Thread(target=speak)
-            thread.daemon = True
-            thread.start()
-            st.session_state.tts_played = True
-    except Exception as e:
-        st.warning(f"Text-to-speech not available: {str(e)}")
-
-def get_weather_data(lat, lon, location_name):
-    """Fetch weather data from OpenWeatherMap API"""
-    try:
-        if not OPENWEATHER_API_KEY:
-            return None
-        
-        url = f"http://api.openweathermap.org/data/2.5/forecast"
-        params = {
-            'lat': lat,
-            'lon': lon,
-            'appid': OPENWEATHER_API_KEY,
-            'units': 'metric',
-            'cnt': 5  # 5-day forecast
-        }
-        
-        response = requests.get(url, params=params, timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        return None
-    except Exception as e:
-        st.error(f"Weather API error: {str(e)}")
-        return None
-
-
+WELCOME_MESSAGE = "Welcome to your AI Travel Planner! Let's plan your perfect adventure!"
+WELCOME_AUDIO_WAIT_SECONDS = 3
 
-def get_location_images(location_name):
-    """Fetch better Unsplash images based on refined location query"""
-    try:
-        if not UNSPLASH_ACCESS_KEY:
-            return []
-
-        location_clean = location_name.split(",")[0].strip()
-        keywords = ["travel", "landmark", "tourism", "attractions", "scenery"]
-        query = f"{location_clean} {random.choice(keywords)}"
-
-        url = "https://api.unsplash.com/search/photos"
-        headers = {"Authorization": f"Client-ID {UNSPLASH_ACCESS_KEY}"}
-        params = {
-            'query': query,
-            'per_page': 6,
-            'orientation': 'landscape'
-        }
-
-        response = requests.get(url, headers=headers, params=params, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            return [photo['urls']['regular'] for photo in data['results']]
-        return []
-    except Exception as e:
-        st.error(f"Image API error: {str(e)}")
-        return []
-
-
-def reverse_geocode(lat, lon):
-    """Get location name from coordinates"""
-    try:
-        geolocator = Nominatim(user_agent="travel_planner")
-        coordinate_string = f"{lat}, {lon}"
-        location = geolocator.reverse(coordinate_string)
-        if location:
-            return str(location)
-        return f"Location at {lat:.4f}, {lon:.4f}"
-    except Exception as e:
-        return f"Location at {lat:.4f}, {lon:.4f}"
-
-def get_user_location_from_ip():
-    """Get user's current location using IP geolocation"""
+def play_welcome_message():
+    """Play the cached welcome audio in the browser, autoplaying once per session"""
+    audio_path = get_speech(WELCOME_MESSAGE, wait=0 if st.session_state.tts_played else WELCOME_AUDIO_WAIT_SECONDS)
+    if audio_path:
+        st.audio(audio_path, format="audio/wav", autoplay=not st.session_state.tts_played)
+    st.session_state.tts_played = True
+
+def plan_summary_text(travel_plan, max_chars=600):
+    """Plain-text opening of a plan, for listening"""
+    sentences = []
+    for kind, level, spans in parse_markdown(travel_plan):
+        if kind in ('paragraph', 'bullet', 'numbered'):
+            sentences.append("".join(text for text, _, _ in (spans[1:] if kind == 'numbered' else spans)))
+        if sum(len(sentence) for sentence in sentences) >= max_chars:
+            break
+    return " ".join(sentences)[:max_chars]
+
+def select_destination_suggestion():
+    """Selectbox callback: make the chosen suggestion the selected destination"""
+    idx = st.session_state.get('destination_suggestion')
+    gazetteer = get_gazetteer()
+    if idx is None or not gazetteer:
+        return
+    st.session_state.selected_location = gazetteer.label(idx)
+    st.session_state.selected_coords = [float(gazetteer.lats[idx]), float(gazetteer.lons[idx])]
+    st.session_state.destination_suggestion = None
+
+def get_client_ip():
+    """Return the visitor's public IP, or None when unknown
+    
+    Proxy headers come first; without a proxy in front, the address of the
+    connection itself is used.
+    """
+    candidates = []
     try:
-        # Try ipinfo.io first (free tier: 50,000 requests/month)
-        response = requests.get("https://ipinfo.io/json", timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            city = data.get('city', '')
-            region = data.get('region', '')
-            country = data.get('country', '')
-            
-            # Format location string
-            location_parts = [part for part in [city, region, country] if part]
-            location_string = ', '.join(location_parts) if location_parts else 'Unknown Location'
-            
-            # Get coordinates if available
-            loc = data.get('loc', '').split(',')
-            lat, lon = (float(loc[0]), float(loc[1])) if len(loc) == 2 else (None, None)
-            
-            return {
-                'location': location_string,
-                'city': city,
-                'region': region,
-                'country': country,
-                'latitude': lat,
-                'longitude': lon,
-                'raw_data': data
-            }
-    except Exception as e:
+        headers = st.context.headers
+        candidates = [ip.strip() for ip in headers.get('X-Forwarded-For', '').split(',')]
+        candidates.append(headers.get('X-Real-IP', '').strip())
+    except Exception:
         pass
-    
     try:
-        # Fallback to ip-api.com (free tier: 1000 requests/hour)
-        response = requests.get("http://ip-api.com/json/", timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('status') == 'success':
-                city = data.get('city', '')
-                region = data.get('regionName', '')
-                country = data.get('country', '')
-                
-                location_parts = [part for part in [city, region, country] if part]
-                location_string = ', '.join(location_parts) if location_parts else 'Unknown Location'
-                
-                return {
-                    'location': location_string,
-                    'city': city,
-                    'region': region,
-                    'country': country,
-                    'latitude': data.get('lat'),
-                    'longitude': data.get('lon'),
-                    'raw_data': data
-                }
-    except Exception as e:
+        candidates.append(st.context.ip_address)
+    except Exception:
         pass
-    
-    # Return default if all methods fail
-    return {
-        'location': 'Location not detected',
-        'city': '',
-        'region': '',
-        'country': '',
-        'latitude': None,
-        'longitude': None,
-        'raw_data': {}
-    }
+    for candidate in candidates:
+        try:
+            if isinstance(candidate, str) and candidate and ipaddress.ip_address(candidate).is_global:
+                return candidate
+        except ValueError:
+            continue
+    return None
 
 def initialize_user_location():
     """Initialize user location on first load"""
@@ -316,114 +195,10 @@ def initialize_user_location():
     
     if not st.session_state.location_fetched:
         with st.spinner("Detecting your location..."):
-            location_data = get_user_location_from_ip()
+            location_data = get_user_location_from_ip(get_client_ip())
             st.session_state.user_location_data = location_data
             st.session_state.location_fetched = True
 
-
-def search_destinations(query):
-    """Search for destination information using SerpAPI"""
-    try:
-        if not SERP_API_KEY:
-            return None
-        
-        url = "https://serpapi.com/search"
-        params = {
-            'q': f"{query} travel guide attractions",
-            'api_key': SERP_API_KEY,
-            'engine': 'google'
-        }
-        
-        response = requests.get(url, params=params, timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        return None
-    except Exception as e:
-        st.error(f"Search API error: {str(e)}")
-        return None
-
-def generate_travel_plan(destination, duration, budget, travel_style, groq_api_key, from_location=None):
-    """Generate travel plan using Groq API"""
-    try:
-        if not groq_api_key:
-            st.error("Please provide your Groq API key")
-            return None
-        
-        client = Groq(api_key=groq_api_key)
-        
-        # Get additional destination info if available
-        search_info = ""
-        if SERP_API_KEY:
-            search_results = search_destinations(destination)
-            if search_results and 'organic_results' in search_results:
-                search_info = "\n\nRecent information about this destination:\n"
-                for result in search_results['organic_results'][:3]:
-                    search_info += f"- {result.get('title', '')}: {result.get('snippet', '')}\n"
-        
-        # Include from location context if available
-        travel_context = ""
-        if from_location and from_location != "Location not detected":
-            travel_context = f"\n\nTraveler's Starting Location: {from_location}\nPlease consider transportation logistics and travel time from this starting point."
-        
-        prompt = f"""Create a comprehensive travel plan for {destination} for {duration} days.
-
-Trip Details:
-- Budget Level: {budget}
-- Travel Style: {', '.join(travel_style)}
-- Duration: {duration} days{travel_context}
-
-
-
-{search_info}
-
-Please provide a detailed itinerary including:
-
-1. *Best Time to Visit* 🌞
-   - Optimal seasons and months
-   - Weather considerations
-
-2. *Accommodation Recommendations* 🏨
-   - {budget} budget options with specific names and areas
-   - Booking tips
-
-3. *Day-by-Day Itinerary* 🗺
-   - Daily activities and attractions
-   - Time estimates and logistics
-   - Must-see highlights
-
-4. *Food & Dining* 🍽
-   - Local specialties to try
-   - Restaurant recommendations
-   - Food experiences
-
-5. *Transportation* 🚗
-   - How to get there
-   - Local transportation options
-   - Travel tips
-
-6. *Budget Breakdown* 💰
-   - Estimated costs for accommodation, food, activities
-   - Money-saving tips
-
-7. *Essential Tips* 💡
-   - Cultural considerations
-   - Safety tips
-   - What to pack
-
-Format the response with clear headings and bullet points. Make it practical and actionable."""
-
-        response = client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="llama-3.3-70b-versatile",
-            temperature=0.7,
-            max_tokens=2000
-        )
-        
-        return response.choices[0].message.content
-    except Exception as e:
-        st.error(f"Error generating travel plan: {str(e)}")
-        return None
-
 def get_user_session_id():
     """Get or create user session ID"""
     return st.session_state.user_session_id
@@ -439,92 +214,151 @@ def save_user_preferences_locally(budget, duration, travel_styles):
     }
     return True
 
-# Saved plans: Save/load in session state only
+# Saved plans: persisted in the shared saved plan store, keyed by user ID
+SAVED_PLANS_PAGE_SIZE = 3
+
 def save_travel_plan_locally(destination, duration, budget, travel_style, plan_content, latitude=None, longitude=None):
-    plan = {
-        'destination': destination,
-        'duration_days': duration,
-        'budget_level': budget,
-        'travel_style': travel_style,
-        'plan_content': plan_content,
-        'latitude': latitude,
-        'longitude': longitude,
-        'created_at': datetime.datetime.now()
-    }
-    st.session_state.saved_plans.insert(0, plan)
+    get_saved_plan_store().save(get_user_session_id(), destination, duration, budget, travel_style,
+                                plan_content, latitude, longitude)
+    st.session_state.saved_plans_page = 0
     return True
 
-def load_saved_travel_plans_locally():
-    return st.session_state.saved_plans
+# Thumbnails written here are served by Streamlit's static file serving
+STATIC_THUMBNAIL_DIR = os.path.join(STATIC_DIR, "thumbnails")
+GALLERY_SIZE = 4
+
+def gallery_images(image_urls):
+    """Pair each gallery image with a local thumbnail URL, falling back to the original"""
+    image_urls = image_urls[:GALLERY_SIZE]
+    thumbnails = fetch_concurrently({idx: (get_thumbnail, (url,)) for idx, url in enumerate(image_urls)})
+    images = []
+    for idx, url in enumerate(image_urls):
+        path = thumbnails.get(idx)
+        if path and os.path.dirname(path) == STATIC_THUMBNAIL_DIR:
+            images.append((f"app/static/thumbnails/{os.path.basename(path)}", url))
+        else:
+            images.append((url, url))
+    return images
+
+def render_export(travel_plan, destination, fmt):
+    """Render a plan download when its button is clicked"""
+    with span("export", format=fmt):
+        return export_plan(travel_plan, destination, fmt)
+
+@st.fragment(run_every=0.5)
+def show_plan_audio_progress(text):
+    """Poll the plan summary's speech synthesis, then rerun the app to play it"""
+    audio_path = get_speech(text)
+    if audio_path is None and speech_pending(text):
+        st.info("🔊 Preparing audio...")
+        return
+    st.session_state.plan_audio_pending = None
+    st.session_state.plan_audio = (text, audio_path)
+    st.session_state.plan_audio_autoplay = True
+    st.rerun()
+
+def request_location_images():
+    """Button callback: ask the next run to fetch destination images"""
+    st.session_state.images_requested = True
+
+@st.fragment(run_every=0.5)
+def show_plan_job_progress(show_partial):
+    """Poll the session's background plan job, showing progress until it finishes"""
+    job = get_plan_job_queue().get(st.session_state.plan_job_id)
+    if job is not None and not job.finished:
+        status = "⏳ Waiting for a free planner..." if job.status == 'queued' else "🔍 Planning your trip..."
+        st.info(status)
+        if show_partial and job.chunks:
+            st.markdown(job.partial_text)
+        if st.button("✖ Cancel", key="cancel_plan_job"):
+            job.cancel()
+        return
+    
+    # Finished: deliver the result to the session and rerun the whole app
+    st.session_state.plan_job_id = None
+    if job is None:
+        st.session_state.plan_job_notice = ('warning', "Plan generation expired, please try again.")
+    elif job.status == 'done' and job.result:
+        params = job.params
+        coords = st.session_state.get('plan_job_coords')
+        lat, lon = (coords[0], coords[1]) if coords else (None, None)
+        st.session_state.travel_plan = job.result
+        st.session_state.structured_plan = job.value
+        st.session_state.qa_history = []
+        # Save plan locally
+        save_travel_plan_locally(params['destination'], params['duration'], params['budget'], params['travel_style'], job.result, lat, lon)
+        st.session_state.plan_job_notice = ('success', "Travel plan saved to your collection!")
+    elif job.status == 'failed':
+        st.session_state.plan_job_notice = ('error', f"Error generating travel plan: {job.error}")
+    else:
+        st.session_state.plan_job_notice = ('info', "Plan generation cancelled.")
+    st.rerun()
+
+def load_saved_travel_plans_locally(page=0):
+    """Return one page of the user's saved plans (without bodies) and the total count"""
+    store = get_saved_plan_store()
+    user_id = get_user_session_id()
+    return store.list(user_id, page * SAVED_PLANS_PAGE_SIZE, SAVED_PLANS_PAGE_SIZE), store.count(user_id)
+
+def load_saved_plan(plan_id):
+    """Button callback: make a saved plan the current plan"""
+    plan = get_saved_plan_store().get(plan_id, get_user_session_id())
+    if plan is None:
+        return
+    st.session_state.travel_plan = plan['plan_content']
+    st.session_state.structured_plan = None
+    st.session_state.qa_history = []
+    st.session_state.selected_location = plan['destination']
+    if plan['latitude'] and plan['longitude']:
+        st.session_state.selected_coords = [plan['latitude'], plan['longitude']]
+
+# Map layers
+SAVED_PLAN_MARKER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindTooltip(row[2]);
+    return marker;
+}
+"""
 
-def create_pdf_from_plan(travel_plan, destination):
-    """Generate PDF from travel plan using HTML conversion"""
-    try:
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>Travel Plan - {destination}</title>
-            <style>
-                body {{ 
-                    font-family: Arial, sans-serif; 
-                    margin: 20px; 
-                    color: #333; 
-                    line-height: 1.6;
-                }}
-                h1 {{ 
-                    color: #00A8E8; 
-                    text-align: center; 
-                    border-bottom: 3px solid #00A8E8;
-                    padding-bottom: 10px;
-                }}
-                h2 {{ 
-                    color: #FF6B6B; 
-                    border-bottom: 2px solid #FF6B6B; 
-                    padding-bottom: 5px; 
-                }}
-                h3 {{ 
-                    color: #4ECDC4; 
-                }}
-                p, li {{ 
-                    line-height: 1.6; 
-                }}
-                .header {{ 
-                    text-align: center; 
-                    margin-bottom: 30px; 
-                }}
-                .content {{ 
-                    max-width: 800px; 
-                    margin: 0 auto; 
-                }}
-                .date {{ 
-                    text-align: right; 
-                    color: #666; 
-                    font-size: 0.9em;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h1>🌎 AI Travel Plan</h1>
-                <h2>Destination: {destination}</h2>
-                <div class="date">Generated on: {datetime.datetime.now().strftime('%B %d, %Y')}</div>
-            </div>
-            <div class="content">
-                {travel_plan.replace('', '<strong>').replace('', '</strong>').replace(chr(10), '<br>').replace('# ', '<h2>').replace('## ', '<h3>').replace('### ', '<h4>')}
-            </div>
-        </body>
-        </html>
-        """
-        
-        # Convert HTML to bytes for download
-        pdf_bytes = html_content.encode('utf-8')
-        return pdf_bytes
-        
-    except Exception as e:
-        st.error(f"PDF generation error: {str(e)}")
-        return None
+def build_base_map():
+    """The base map, identical on every rerun
+    
+    st_folium mutates the map object it renders, so the object itself is
+    not shared between reruns. Because the map never changes and the
+    component has a stable key, the frontend keeps its Leaflet instance and
+    only the marker feature groups are swapped.
+    """
+    import folium
+    return folium.Map(location=[20.0, 0.0], zoom_start=2)
+
+def build_marker_layers():
+    """Feature groups for the selected destination and the user's saved plans"""
+    import folium
+    from folium.plugins import FastMarkerCluster
+    
+    layers = []
+    if st.session_state.selected_coords:
+        selected = folium.FeatureGroup(name="Selected destination")
+        folium.Marker(
+            st.session_state.selected_coords, 
+            popup=f"Selected: {st.session_state.selected_location}",
+            icon=folium.Icon(color='red', icon='info-sign')
+        ).add_to(selected)
+        layers.append(selected)
+    
+    saved_locations = get_saved_plan_store().locations(get_user_session_id())
+    if saved_locations:
+        # Markers are created client-side from the raw rows and clustered,
+        # which keeps thousands of points cheap to send and draw
+        saved = folium.FeatureGroup(name="Saved plans")
+        FastMarkerCluster([list(row) for row in saved_locations], callback=SAVED_PLAN_MARKER_CALLBACK).add_to(saved)
+        layers.append(saved)
+    return layers
+
+def change_saved_plans_page(step):
+    """Button callback: move through the saved plan pages"""
+    st.session_state.saved_plans_page = max(st.session_state.saved_plans_page + step, 0)
 
 # Load user preferences on startup
 # REMOVE: load_user_preferences()
@@ -532,21 +366,16 @@ def create_pdf_from_plan(travel_plan, destination):
 # Initialize user location detection
 initialize_user_location()
 
-# Play welcome message
-play_welcome_message()
-
 # Main header
-st.markdown("""
-    <div class="main-header">
-        <h1>🌎 AI Travel Planner</h1>
-        <p style="font-size: 1.2rem; color: #666;">Plan your perfect adventure with AI assistance</p>
-    </div>
-""", unsafe_allow_html=True)
+st.markdown(load_static_asset("header.html"), unsafe_allow_html=True)
 
 # Sidebar - Trip Settings
 with st.sidebar:
     st.image("https://img.icons8.com/clouds/200/airplane-take-off.png")
     st.title("🎯 Trip Settings")
+    
+    # Play welcome message
+    play_welcome_message()
 
     # API Keys
     groq_api_key = st.text_input("🔑 Groq API Key", type="password", value=GROQ_API_KEY)
@@ -609,6 +438,19 @@ with st.sidebar:
     
     # Trip parameters
     destination = st.text_input("🌍 To Destination", value=st.session_state.selected_location or "")
+    
+    # Local autocomplete: suggest matching places until one is chosen
+    if destination and destination != st.session_state.selected_location:
+        suggestions = suggest_destinations(destination)
+        if suggestions:
+            gazetteer = get_gazetteer()
+            st.selectbox(
+                "📌 Matching places",
+                options=[None] + suggestions,
+                format_func=lambda idx: "Choose a match..." if idx is None else gazetteer.label(idx),
+                key="destination_suggestion",
+                on_change=select_destination_suggestion
+            )
     duration = st.number_input("📅 Duration (days)", min_value=1, max_value=30, value=default_duration)
     budget = st.select_slider("💰 Budget Level", options=["Budget", "Moderate", "Luxury"], value=default_budget)
     travel_style = st.multiselect("🎯 Travel Style", 
@@ -626,23 +468,45 @@ with st.sidebar:
     
     # Saved Travel Plans Section
     st.subheader("📚 Your Saved Plans")
-    saved_plans = load_saved_travel_plans_locally()
+    saved_plans, saved_total = load_saved_travel_plans_locally(st.session_state.saved_plans_page)
+    if not saved_plans and st.session_state.saved_plans_page > 0:
+        # The page emptied out (e.g. fewer plans than before): go back to the first one
+        st.session_state.saved_plans_page = 0
+        saved_plans, saved_total = load_saved_travel_plans_locally(0)
     
     if saved_plans:
-        for plan in saved_plans[:3]:  # Show recent 3 plans
+        for plan in saved_plans:
             with st.expander(f"📍 {plan['destination']} ({plan['duration_days']} days)"):
                 st.write(f"*Budget:* {plan['budget_level']}")
                 st.write(f"*Style:* {', '.join(plan['travel_style']) if plan['travel_style'] else 'Not specified'}")
-                st.write(f"*Created:* {plan['created_at'].strftime('%Y-%m-%d')}")
+                st.write(f"*Created:* {datetime.datetime.fromtimestamp(plan['created_at']).strftime('%Y-%m-%d')}")
                 
-                if st.button(f"🔄 Load Plan", key=f"load_{plan['destination']}"):
-                    st.session_state.travel_plan = plan['plan_content']
-                    st.session_state.selected_location = plan['destination']
-                    if plan['latitude'] and plan['longitude']:
-                        st.session_state.selected_coords = [plan['latitude'], plan['longitude']]
-                    st.rerun()
+                st.button("🔄 Load Plan", key=f"load_{plan['plan_id']}", on_click=load_saved_plan, args=(plan['plan_id'],))
+        
+        # Pagination
+        page = st.session_state.saved_plans_page
+        page_count = -(-saved_total // SAVED_PLANS_PAGE_SIZE)
+        if page_count > 1:
+            prev_col, page_col, next_col = st.columns([1, 2, 1])
+            prev_col.button("◀", key="saved_plans_prev", disabled=page == 0,
+                            on_click=change_saved_plans_page, args=(-1,))
+            page_col.caption(f"Page {page + 1} of {page_count}")
+            next_col.button("▶", key="saved_plans_next", disabled=page + 1 >= page_count,
+                            on_click=change_saved_plans_page, args=(1,))
     else:
         st.info("No saved plans yet. Create your first travel plan!")
+    
+    # Plan cache statistics
+    cache_stats = get_plan_cache().stats()
+    st.caption(f"⚡ Plan cache: {cache_stats['hits']} hits | {cache_stats['misses']} misses | {cache_stats['entries']} stored")
+    weather_stats = get_weather_cache().stats()
+    st.caption(f"🌤 Weather cache: {weather_stats['hit_rate']:.0%} hit rate | {weather_stats['entries']} cells")
+    reuse_stats = get_plan_similarity_index().stats()
+    st.caption(f"♻️ Plan reuse: {reuse_stats['served']} served | {reuse_stats['drafted']} adapted")
+    run_stats = get_run_timings().stats()
+    if run_stats['cold_start'] is not None:
+        rerun_info = f" | rerun p50 {run_stats['p50'] * 1000:.0f} ms, p95 {run_stats['p95'] * 1000:.0f} ms" if 'p50' in run_stats else ""
+        st.caption(f"⏱ Cold start {run_stats['cold_start']:.2f}s{rerun_info}")
 
 # Main content layout
 col1, col2 = st.columns([1, 1])
@@ -656,35 +520,47 @@ with col1:
         </div>
     """, unsafe_allow_html=True)
     
-    # Create map
-    m = folium.Map(location=[20.0, 0.0], zoom_start=2)
-    
-    # Add marker if location is selected
-    if st.session_state.selected_coords:
-        folium.Marker(
-            st.session_state.selected_coords, 
-            popup=f"Selected: {st.session_state.selected_location}",
-            icon=folium.Icon(color='red', icon='info-sign')
-        ).add_to(m)
-    
-    # Display map with container styling
+    # Display map with container styling; only the marker layers change between reruns
     st.markdown('<div class="map-container">', unsafe_allow_html=True)
-    map_data = st_folium(m, width=400, height=300)
+    # Imported here so the header and sidebar render before the map libraries load
+    with span("map"):
+        from streamlit_folium import st_folium
+        map_data = st_folium(build_base_map(), key="destination_map", width=400, height=300,
+                             feature_group_to_add=build_marker_layers(), returned_objects=["last_clicked"])
     st.markdown('</div>', unsafe_allow_html=True)
     
-    # Handle map clicks
-    if map_data['last_object_clicked_tooltip'] or map_data['last_clicked']:
-        if map_data['last_clicked']:
-            lat = map_data['last_clicked']['lat']
-            lon = map_data['last_clicked']['lng']
-            location_name = reverse_geocode(lat, lon)
-            st.session_state.selected_location = location_name
-            st.session_state.selected_coords = [lat, lon]
-            
-            st.success(f"📍 Selected: {location_name}")
-            st.info(f"📐 Coordinates: {lat:.4f}, {lon:.4f}")
+    # Handle new map clicks (the component keeps returning the last one)
+    last_clicked = map_data.get('last_clicked') if map_data else None
+    if last_clicked and last_clicked != st.session_state.get('last_map_click'):
+        st.session_state.last_map_click = last_clicked
+        lat = last_clicked['lat']
+        lon = last_clicked['lng']
+        location_name = reverse_geocode(lat, lon)
+        st.session_state.selected_location = location_name
+        st.session_state.selected_coords = [lat, lon]
+        
+        st.success(f"📍 Selected: {location_name}")
+        st.info(f"📐 Coordinates: {lat:.4f}, {lon:.4f}")
 
 with col2:
+    # Fetch weather and requested images in parallel so the slowest provider bounds the wait
+    provider_tasks = {}
+    if st.session_state.selected_coords and openweather_key:
+        lat, lon = st.session_state.selected_coords
+        provider_tasks['weather'] = (get_weather_data, (lat, lon, st.session_state.selected_location))
+    images_requested = st.session_state.pop('images_requested', False)
+    if images_requested and st.session_state.selected_location and unsplash_key:
+        city_only = st.session_state.selected_location.split(",")[0].strip()
+        provider_tasks['images'] = (get_location_images, (city_only,))
+    
+    if 'images' in provider_tasks:
+        with st.spinner("Loading destination images..."), span("providers"):
+            provider_results = fetch_concurrently(provider_tasks)
+            st.session_state.location_images = gallery_images(provider_results['images'] or [])
+    else:
+        with span("providers"):
+            provider_results = fetch_concurrently(provider_tasks)
+    
     # Weather Information
     if st.session_state.selected_coords and openweather_key:
         st.markdown("""
@@ -693,24 +569,21 @@ with col2:
             </div>
         """, unsafe_allow_html=True)
         
-        lat, lon = st.session_state.selected_coords
-        weather_data = get_weather_data(lat, lon, st.session_state.selected_location)
+        weather_data = provider_results.get('weather')
+        st.session_state.weather_data = weather_data
         
         if weather_data:
             st.markdown('<div class="weather-card">', unsafe_allow_html=True)
-            current = weather_data['list'][0]
-            st.markdown(f"🌡 Current:** {current['main']['temp']:.1f}°C")
-            st.markdown(f"📝 Description:** {current['weather'][0]['description'].title()}")
-            st.markdown(f"💧 Humidity:** {current['main']['humidity']}%")
+            current = weather_data['current']
+            st.markdown(f"🌡 Current:** {current['temp']:.1f}°C")
+            st.markdown(f"📝 Description:** {current['description'].title()}")
+            st.markdown(f"💧 Humidity:** {current['humidity']}%")
             st.markdown('</div>', unsafe_allow_html=True)
             
-            # 5-day forecast
+            # 5-day forecast, aggregated per local day
             st.markdown("📅 5-Day Forecast:")
-            for i, forecast in enumerate(weather_data['list'][:5]):
-                date = forecast['dt_txt'].split(' ')[0]
-                temp = forecast['main']['temp']
-                desc = forecast['weather'][0]['description']
-                st.markdown(f"• {date}: {temp:.1f}°C, {desc.title()}")
+            for day in weather_data['daily'][:5]:
+                st.markdown(f"• {day['date']}: {day['temp_min']:.0f}–{day['temp_max']:.0f}°C, {day['condition']}, {day['pop']:.0%} rain")
         else:
             st.info("Weather data unavailable. Add your OpenWeather API key for forecasts.")
     
@@ -723,21 +596,18 @@ with col2:
         """, unsafe_allow_html=True)
         
         if unsplash_key:
-            if st.button("🖼 Load Images"):
-                with st.spinner("Loading destination images..."):
-                    city_only = st.session_state.selected_location.split(",")[0].strip()
-                images = get_location_images(city_only)
-                st.session_state.location_images = images
+            # Flag the request so the next run fetches images alongside the weather
+            st.button("🖼 Load Images", on_click=request_location_images)
             
             if st.session_state.location_images:
-                st.markdown('<div class="image-gallery">', unsafe_allow_html=True)
-                for idx, img_url in enumerate(st.session_state.location_images[:4]):
-                    st.markdown(f'''
-                        <div class="image-item">
-                            <img src="{img_url}" alt="Destination Image {idx+1}" />
-                        </div>
-                    ''', unsafe_allow_html=True)
-                st.markdown('</div>', unsafe_allow_html=True)
+                width, height = THUMBNAIL_SIZE
+                items = "".join(
+                    f'<div class="image-item"><a href="{html.escape(url)}" target="_blank">'
+                    f'<img src="{html.escape(src)}" alt="Destination Image {idx+1}" loading="lazy" decoding="async" '
+                    f'width="{width}" height="{height}" style="width: 100%; height: auto;" /></a></div>'
+                    for idx, (src, url) in enumerate(st.session_state.location_images)
+                )
+                st.markdown(f'<div class="image-gallery">{items}</div>', unsafe_allow_html=True)
         else:
             st.info("Add your Unsplash API key to view destination images.")
 
@@ -759,68 +629,118 @@ if destination:
 # Generate Plan
 col1, col2 = st.columns([3, 1])
 with col1:
+    force_regenerate = st.checkbox("🔁 Force regenerate", help="Skip cached plans and ask the AI for a fresh itinerary")
+    stream_responses = st.checkbox("⚡ Stream responses", value=True, help="Show AI answers as they are written")
+    # Long trips default to structured mode, which writes day chunks in parallel
+    structured_plan_mode = st.checkbox(
+        "🧩 Structured plan",
+        value=duration > DAY_CHUNK_SIZE,
+        help="Generate the plan section by section and day by day, so later tweaks only regenerate what changed and long trips are written in parallel"
+    )
     if st.button("✨ Generate My Perfect Travel Plan", type="primary"):
         if destination and groq_api_key:
-            with st.spinner("🔍 Planning your trip..."):
-                travel_plan = generate_travel_plan(destination, duration, budget, travel_style, groq_api_key, from_location)
-                if travel_plan:
-                    st.session_state.travel_plan = travel_plan
-                    st.markdown(travel_plan)
-                    # Save plan locally
-                    coords = st.session_state.selected_coords
-                    lat, lon = (coords[0], coords[1]) if coords else (None, None)
-                    save_travel_plan_locally(destination, duration, budget, travel_style, travel_plan, lat, lon)
-                    st.success("Travel plan saved to your collection!")
+            # Resolve typed destinations locally so weather and saved plans get coordinates
+            if destination != st.session_state.selected_location:
+                place = forward_geocode(destination)
+                if place:
+                    st.session_state.selected_location = destination
+                    st.session_state.selected_coords = [place['latitude'], place['longitude']]
+            # Run generation in the background so reruns don't throw the work away
+            coords = st.session_state.selected_coords
+            plan_args = dict(
+                destination=destination,
+                duration=duration,
+                budget=budget,
+                travel_style=travel_style,
+                groq_api_key=groq_api_key,
+                from_location=from_location,
+                force_regenerate=force_regenerate,
+                coords=coords
+            )
+            try:
+                if structured_plan_mode:
+                    # Reuse unaffected sections and days of the last structured plan
+                    job = get_plan_job_queue().submit(stream_structured_plan, previous=st.session_state.structured_plan, **plan_args)
+                else:
+                    job = get_plan_job_queue().submit(**plan_args)
+                st.session_state.plan_job_id = job.id
+                st.session_state.plan_job_coords = coords
+            except PlanQueueFull as e:
+                st.warning(str(e))
         elif not destination:
             st.warning("Please enter a destination first.")
         else:
             st.warning("Please provide your Groq API key.")
 
+    # Poll the background job, if any
+    if st.session_state.plan_job_id:
+        show_plan_job_progress(stream_responses)
+    
+    plan_job_notice = st.session_state.pop('plan_job_notice', None)
+    if plan_job_notice:
+        level, message = plan_job_notice
+        getattr(st, level)(message)
+
 with col2:
     if st.session_state.travel_plan:
-        # PDF Export
-        pdf_data = create_pdf_from_plan(st.session_state.travel_plan, destination)
-        if pdf_data:
-            st.download_button(
-                label="📄 Download PDF",
-                data=pdf_data,
-                file_name=f"travel_plan_{destination.replace(' ', '_')}.html",
-                mime="text/html",
-                help="Download your travel plan as HTML file"
+        # Exports are rendered only when a download button is clicked
+        export_labels = {'pdf': "📄 Download PDF", 'html': "🌐 HTML", 'text': "📝 Text"}
+        formats = available_formats()
+        for export_col, fmt in zip(st.columns(len(formats)), formats):
+            export_col.download_button(
+                label=export_labels[fmt],
+                data=functools.partial(render_export, st.session_state.travel_plan, destination, fmt),
+                file_name=export_file_name(destination, fmt),
+                mime=EXPORT_FORMATS[fmt][0],
+                key=f"export_{fmt}",
+                on_click="ignore",
+                help=f"Download your travel plan as a {EXPORT_FORMATS[fmt][1].upper()} file"
             )
 
 # Display existing travel plan
 if st.session_state.travel_plan:
     st.divider()
     st.markdown("### Your Travel Plan")
+    summary_text = plan_summary_text(st.session_state.travel_plan)
+    if st.button("🔊 Listen to summary", key="listen_plan_summary"):
+        st.session_state.plan_audio = None
+        st.session_state.plan_audio_pending = summary_text
+    if st.session_state.plan_audio_pending == summary_text:
+        # Synthesis runs in the background; the fragment polls without blocking this run
+        show_plan_audio_progress(summary_text)
+    elif st.session_state.plan_audio and st.session_state.plan_audio[0] == summary_text:
+        audio_path = st.session_state.plan_audio[1]
+        if audio_path:
+            st.audio(audio_path, format="audio/wav", autoplay=st.session_state.plan_audio_autoplay)
+        else:
+            st.info("Audio is not available right now.")
+        st.session_state.plan_audio_autoplay = False
     st.markdown(st.session_state.travel_plan)
 
 # Q&A Section
 st.divider()
 qa_expander = st.expander("🤔 Ask a specific question about your destination or travel plan", expanded=False)
 with qa_expander:
+    # Recent conversation
+    for turn in st.session_state.qa_history[-3:]:
+        st.markdown(f"**You:** {turn['question']}")
+        st.markdown(turn['answer'])
+    if st.session_state.qa_history and st.button("🧹 Clear conversation", key="qa_clear"):
+        st.session_state.qa_history = []
+        st.rerun()
+    
     question = st.text_input("Your question:", placeholder="e.g., What's the best local food to try?")
     if st.button("Get Answer", key="qa_button"):
         if question and groq_api_key:
-            with st.spinner("🔍 Finding answer..."):
-                context_prompt = f"""
-                Based on the destination {destination}, answer this question: {question}
-                
-                {"Context from travel plan: " + st.session_state.travel_plan if st.session_state.travel_plan else ""}
-                
-                Provide a helpful, detailed answer about {destination}.
-                """
-                
+            with st.spinner("🔍 Finding answer..."), span("qa"):
                 try:
-                    client = Groq(api_key=groq_api_key)
-                    response = client.chat.completions.create(
-                        messages=[{"role": "user", "content": context_prompt}],
-                        model="llama-3.3-70b-versatile",
-                        temperature=0.7,
-                        max_tokens=500
-                    )
-                    answer = response.choices[0].message.content
-                    st.markdown(answer)
+                    answer = answer_question(question, destination, groq_api_key, st.session_state.travel_plan, stream=stream_responses, history=st.session_state.qa_history)
+                    if stream_responses:
+                        answer = st.write_stream(answer)
+                    else:
+                        st.markdown(answer)
+                    # Remember the turn for follow-up questions
+                    st.session_state.qa_history.append({'question': question, 'answer': answer})
                 except Exception as e:
                     st.error(f"Error getting answer: {str(e)}")
         elif not question:
@@ -830,9 +750,7 @@ with qa_expander:
 
 # Footer
 st.divider()
-st.markdown("""
-    <div style="text-align: center; color: #666; padding: 2rem;">
-        <p>🌎 AI Travel Planner - Plan your perfect adventure with artificial intelligence</p>
-        <p>Add your API keys in the sidebar to unlock all features</p>
-    </div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+st.markdown(load_static_asset("footer.html"), unsafe_allow_html=True)
+
+# Record this run's duration (the first run in the process is the cold start)
+get_run_timings().record(finish_run_trace(), {'imports': imports_finished - imports_started})